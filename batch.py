@@ -0,0 +1,183 @@
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+from typing import List, NamedTuple, Optional
+import argparse
+import csv
+import glob
+import json
+import os
+import resource
+import signal
+import sys
+import time
+
+from main import Solver, Algorithm
+from model.Game import Game
+
+
+class BatchResult(NamedTuple):
+    level: str
+    status: str
+    plan: List[str]
+    expanded: int
+    generated: int
+    time: float
+    peak_memory: int
+    error: Optional[str] = None
+
+
+STATUS_SOLVED = "solved"
+STATUS_UNSOLVED = "unsolved"
+STATUS_TIMEOUT = "timeout"
+STATUS_MEMORY = "memory"
+STATUS_ERROR = "error"
+
+# a worker under a memory limit that dies without reporting ran out of memory only if a failed allocation aborted it
+# (outside of Python's MemoryError) or the kernel's out of memory killer stopped it
+MEMORY_EXIT_CODES = (-signal.SIGABRT, -signal.SIGKILL)
+
+REPORT_FIELDS = list(BatchResult._fields)
+
+
+def collect_level_paths(patterns: List[str]) -> List[str]:
+    """Expands directories (recursively) and glob patterns into a sorted list of level files."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "**", "*.json"), recursive=True)
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        for path in sorted(matches):
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def peak_memory_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def solve_level(path: str, algorithm: Algorithm = Algorithm.ASTAR, weight: float = 2.0,
+                compiled: bool = False) -> BatchResult:
+    start = time.time()
+    try:
+        game = Game()
+        game.play(path, compiled)
+        result = Solver(algorithm, weight).search(game)
+    except MemoryError:
+        return BatchResult(path, STATUS_MEMORY, [], 0, 0, time.time() - start, peak_memory_kb())
+    except Exception as e:
+        return BatchResult(path, STATUS_ERROR, [], 0, 0, time.time() - start, peak_memory_kb(), repr(e))
+
+    status = STATUS_SOLVED if len(result.plan) > 0 else STATUS_UNSOLVED
+    return BatchResult(path, status, [action.name for action in result.plan], result.expanded, result.generated,
+                       time.time() - start, peak_memory_kb())
+
+
+def solve_level_worker(conn, path, algorithm, weight, memory_limit_mb, compiled):
+    if memory_limit_mb is not None:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        conn.send(solve_level(path, algorithm, weight, compiled))
+    except MemoryError:
+        conn.send(BatchResult(path, STATUS_MEMORY, [], 0, 0, 0.0, peak_memory_kb()))
+    finally:
+        conn.close()
+
+
+def run_batch(paths: List[str], workers: int = 1, timeout: Optional[float] = None,
+              memory_limit_mb: Optional[int] = None, algorithm: Algorithm = Algorithm.ASTAR, weight: float = 2.0,
+              compiled: bool = False):
+    """Solves every level in its own process, at most workers at a time, yielding results as they finish.
+
+    A level running longer than timeout seconds is terminated, a level exceeding memory_limit_mb of address
+    space fails with MemoryError inside its process.
+    """
+    pending = list(reversed(paths))
+    running = {}
+
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < max(1, workers):
+            path = pending.pop()
+            recv_conn, send_conn = Pipe(duplex=False)
+            process = Process(target=solve_level_worker,
+                              args=(send_conn, path, algorithm, weight, memory_limit_mb, compiled), daemon=True)
+            process.start()
+            send_conn.close()
+            running[recv_conn] = (path, process, time.time())
+
+        wait_time = None
+        if timeout is not None:
+            now = time.time()
+            wait_time = max(0.0, min(started + timeout - now for _, _, started in running.values()))
+
+        for conn in wait(list(running.keys()), wait_time):
+            path, process, started = running.pop(conn)
+            try:
+                result = conn.recv()
+            except EOFError:
+                process.join()
+                out_of_memory = memory_limit_mb is not None and process.exitcode in MEMORY_EXIT_CODES
+                status = STATUS_MEMORY if out_of_memory else STATUS_ERROR
+                result = BatchResult(path, status, [], 0, 0, time.time() - started, 0,
+                                     "worker exited with code " + str(process.exitcode))
+            conn.close()
+            process.join()
+            yield result
+
+        if timeout is not None:
+            now = time.time()
+            for conn, (path, process, started) in list(running.items()):
+                if now - started >= timeout:
+                    process.terminate()
+                    process.join()
+                    conn.close()
+                    del running[conn]
+                    yield BatchResult(path, STATUS_TIMEOUT, [], 0, 0, now - started, 0)
+
+
+def write_report(results, out, report_format: str = "jsonl"):
+    if report_format == "csv":
+        writer = csv.DictWriter(out, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+    for result in results:
+        row = result._asdict()
+        if report_format == "csv":
+            row["plan"] = " ".join(result.plan)
+            writer.writerow(row)
+        else:
+            out.write(json.dumps(row) + "\n")
+        out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve many Lara Croft Go levels in parallel")
+    parser.add_argument("levels", nargs="+", help="level files, directories or glob patterns")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--timeout", type=float, default=None, help="per-level time limit in seconds")
+    parser.add_argument("--memory", type=int, default=None, help="per-level memory limit in MB")
+    parser.add_argument("--algorithm", choices=[a.value for a in Algorithm], default=Algorithm.ASTAR.value,
+                        help="search algorithm (default: astar)")
+    parser.add_argument("--weight", type=float, default=2.0, help="heuristic weight for wastar (default: 2.0)")
+    parser.add_argument("--compiled", action="store_true", help="reuse compiled levels written next to the json")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl", help="report format (default: jsonl)")
+    parser.add_argument("--output", default=None, help="report file (default: standard output)")
+    args = parser.parse_args()
+
+    paths = collect_level_paths(args.levels)
+    if len(paths) == 0:
+        print("Error: No levels found", file=sys.stderr)
+        return
+
+    results = run_batch(paths, args.workers, args.timeout, args.memory, Algorithm(args.algorithm), args.weight,
+                        args.compiled)
+    if args.output is None:
+        write_report(results, sys.stdout, args.format)
+    else:
+        with open(args.output, "w", newline="") as out:
+            write_report(results, out, args.format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+from typing import List, NamedTuple
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from batch import collect_level_paths
+from main import Solver, Algorithm
+from model.Game import Game
+
+DEFAULT_LEVELS = ["./levels"]
+DEFAULT_BASELINE = "./benchmark_baseline.json"
+
+
+class BenchmarkResult(NamedTuple):
+    level: str
+    expanded: int
+    generated: int
+    plan_length: int
+    time: float
+    states_per_second: float
+    peak_memory: int
+
+
+class Regression(NamedTuple):
+    level: str
+    metric: str
+    baseline: float
+    current: float
+
+
+def benchmark_level(path: str, repeat: int = 3, algorithm: Algorithm = Algorithm.ASTAR,
+                    weight: float = 2.0) -> BenchmarkResult:
+    """Solves a level repeat times, time is the median wall time and peak_memory the traced peak in bytes."""
+    if repeat < 1:
+        raise ValueError("repeat must be at least 1, not " + str(repeat))
+    times = []
+    for _ in range(repeat):
+        game = Game()
+        game.play(path)
+        start = time.perf_counter()
+        result = Solver(algorithm, weight).search(game)
+        times.append(time.perf_counter() - start)
+
+    game = Game()
+    game.play(path)
+    tracemalloc.start()
+    Solver(algorithm, weight).search(game)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    median = statistics.median(times)
+    states_per_second = result.expanded / median if median > 0 else 0.0
+    return BenchmarkResult(path, result.expanded, result.generated, len(result.plan), median, states_per_second,
+                           peak_memory)
+
+
+def compare(results: List[BenchmarkResult], baseline: dict, time_threshold: float = 1.5,
+            memory_threshold: float = 1.5, min_time: float = 0.01) -> List[Regression]:
+    """Lists the metrics that regressed against the baseline.
+
+    Search effort (expanded, generated states) and plan length must not grow at all, time and memory may grow up to
+    their threshold ratio. Times below min_time are too noisy to compare. Levels without a baseline entry are
+    listed by missing_levels.
+    """
+    regressions = []
+    for result in results:
+        base = baseline.get(result.level)
+        if base is None:
+            continue
+
+        for metric in ("expanded", "generated", "plan_length"):
+            if getattr(result, metric) > base[metric]:
+                regressions.append(Regression(result.level, metric, base[metric], getattr(result, metric)))
+        if max(result.time, base["time"]) >= min_time and result.time > base["time"] * time_threshold:
+            regressions.append(Regression(result.level, "time", base["time"], result.time))
+        if result.peak_memory > base["peak_memory"] * memory_threshold:
+            regressions.append(Regression(result.level, "peak_memory", base["peak_memory"], result.peak_memory))
+    return regressions
+
+
+def missing_levels(results: List[BenchmarkResult], baseline: dict) -> List[str]:
+    """Lists the benchmarked levels that have no baseline entry and so were not compared."""
+    return [result.level for result in results if result.level not in baseline]
+
+
+def load_baseline(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results: List[BenchmarkResult], path: str):
+    with open(path, "w") as f:
+        json.dump({result.level: result._asdict() for result in results}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the solver over level packs")
+    parser.add_argument("levels", nargs="*", default=DEFAULT_LEVELS, help="level files, directories or glob patterns")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per level (default: 3)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file")
+    parser.add_argument("--update", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--time-threshold", type=float, default=1.5,
+                        help="allowed ratio of time against the baseline (default: 1.5)")
+    parser.add_argument("--memory-threshold", type=float, default=1.5,
+                        help="allowed ratio of peak memory against the baseline (default: 1.5)")
+    parser.add_argument("--algorithm", choices=[a.value for a in Algorithm], default=Algorithm.ASTAR.value,
+                        help="search algorithm (default: astar)")
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    results = []
+    for path in collect_level_paths(args.levels):
+        result = benchmark_level(os.path.normpath(path), args.repeat, Algorithm(args.algorithm))
+        results.append(result)
+        print("%-40s expanded %7d  generated %7d  %9.4f s  %10.0f states/s  %8d KiB" % (
+            result.level, result.expanded, result.generated, result.time, result.states_per_second,
+            result.peak_memory // 1024))
+
+    if args.update:
+        save_baseline(results, args.baseline)
+        print("Baseline written to " + args.baseline)
+        return
+
+    if not os.path.exists(args.baseline):
+        print("Error: Missing baseline " + args.baseline + ", run with --update first")
+        sys.exit(2)
+
+    baseline = load_baseline(args.baseline)
+    missing = missing_levels(results, baseline)
+    for level in missing:
+        print("MISSING %s: not in baseline %s, run with --update to add it" % (level, args.baseline))
+    regressions = compare(results, baseline, args.time_threshold, args.memory_threshold)
+    for regression in regressions:
+        print("REGRESSION %s %s: %s -> %s" % regression)
+    if len(missing) == len(results):
+        print("Error: No level matches the baseline " + args.baseline)
+        sys.exit(2)
+    if len(regressions) > 0 or len(missing) > 0:
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import random
+import sys
+
+DIRECTIONS = {"l": (-1, 0), "r": (1, 0), "u": (0, 1), "d": (0, -1)}
+OPPOSITE = {"l": "r", "r": "l", "u": "d", "d": "u"}
+
+
+def route(start: Tuple[int, int], end: Tuple[int, int], rng: random.Random) -> List[Tuple[int, int]]:
+    """Monotone path between two cells of a grid, randomly interleaving horizontal and vertical steps."""
+    x, y = start
+    cells = [(x, y)]
+    while (x, y) != end:
+        step_x = (end[0] > x) - (end[0] < x)
+        step_y = (end[1] > y) - (end[1] < y)
+        if step_x != 0 and (step_y == 0 or rng.random() < 0.5):
+            x += step_x
+        else:
+            y += step_y
+        cells.append((x, y))
+    return cells
+
+
+def generate_level(width: int, height: int, levels: int = 1, cracked: int = 0, moving: int = 0, levers: int = 0,
+                   snakes: int = 0, saws: int = 0, spiders: int = 0, lizards: int = 0, spears: int = 0,
+                   density: float = 0.85, seed: Optional[int] = None) -> dict:
+    """Random level in the json schema read by Game.load_game.
+
+    Every z level is a width x height grid where each cell holds a tile with probability density. A path leads
+    from the agent on the top level through cracked tiles dropping to the next level down to the goal on the bottom
+    level. The other elements are placed on random tiles off that path and no trap starts on or guarding it, but
+    saws and spiders may patrol across it and lizards wake up on it, so the level stays loadable but is not
+    guaranteed to be solvable once traps start moving. Each spear gets an air connection towards an attackable trap
+    on its z level, thrown from the last tile on the route from the spear to the trap that no trap holds or guards.
+    """
+    rng = random.Random(seed)
+
+    waypoints = [(rng.randrange(width), rng.randrange(height)) for _ in range(levels - 1)]
+    waypoints.append((width - 1, height - 1))
+    start = (0, 0, 0)
+
+    path = set()
+    entry = (0, 0)
+    for z, waypoint in enumerate(waypoints):
+        for x, y in route(entry, waypoint, rng):
+            path.add((x, y, z))
+        entry = waypoint
+
+    cells: Dict[Tuple[int, int, int], dict] = {}
+    for z in range(levels):
+        for y in range(height):
+            for x in range(width):
+                if (x, y, z) in path or rng.random() < density:
+                    cells[(x, y, z)] = {"type": "Tile"}
+
+    drops = {}
+    for z, (x, y) in enumerate(waypoints[:-1]):
+        cells[(x, y, z)] = {"type": "CrackedTile"}
+        drops[(x, y, z)] = (x, y, z + 1)
+    cells[(width - 1, height - 1, levels - 1)]["is_goal"] = True
+
+    free = sorted(cell for cell in cells if cell not in path)
+    rng.shuffle(free)
+    for cell in free[:cracked]:
+        below = (cell[0], cell[1], cell[2] + 1)
+        cells[cell] = {"type": "CrackedTile"}
+        drops[cell] = below if below in cells else None
+
+    reachable = {start}
+    stack = [start]
+    while len(stack) > 0:
+        x, y, z = stack.pop()
+        neighbors = [(x + dx, y + dy, z) for dx, dy in DIRECTIONS.values()]
+        if drops.get((x, y, z)) is not None:
+            neighbors.append(drops[(x, y, z)])
+        for neighbor in neighbors:
+            if neighbor in cells and neighbor not in reachable:
+                reachable.add(neighbor)
+                stack.append(neighbor)
+    cells = {cell: tile for cell, tile in cells.items() if cell in reachable}
+    ids = {cell: i + 1 for i, cell in enumerate(sorted(cells, key=lambda c: (c[2], c[1], c[0])))}
+
+    free = [cell for cell in sorted(cells) if cell not in path and cells[cell]["type"] == "Tile"]
+    rng.shuffle(free)
+
+    def take():
+        return free.pop() if len(free) > 0 else None
+
+    def neighbor_of(cell, direction):
+        dx, dy = DIRECTIONS[direction]
+        neighbor = (cell[0] + dx, cell[1] + dy, cell[2])
+        return neighbor if neighbor in cells else None
+
+    def guarded_by(cell):
+        options = [n for n in (neighbor_of(cell, d) for d in sorted(DIRECTIONS)) if n is not None and n not in path]
+        return rng.choice(options) if len(options) > 0 else None
+
+    def patrol(cell):
+        direction = rng.choice(sorted(DIRECTIONS))
+        steps = 0
+        while steps < 3 and neighbor_of(cell, direction) is not None:
+            cell = neighbor_of(cell, direction)
+            steps += 1
+        steps = max(steps, 1)
+        return [direction] * steps + [OPPOSITE[direction]] * steps
+
+    moving_cells = []
+    for _ in range(moving):
+        cell = take()
+        if cell is None:
+            break
+        cells[cell] = {"type": "MovingTile", "active": rng.random() < 0.5}
+        moving_cells.append(cell)
+
+    levers_json = []
+    for _ in range(levers if len(moving_cells) > 0 else 0):
+        cell = take()
+        if cell is None:
+            break
+        activates = rng.sample(moving_cells, rng.randint(1, min(3, len(moving_cells))))
+        levers_json.append({"pos": [ids[cell]], "tiles": [ids[c] for c in activates]})
+
+    traps_json = []
+    targets = []
+    trapped = set()
+    for trap_type, count in (("Snake", snakes), ("Saw", saws), ("Spider", spiders), ("Lizard", lizards)):
+        for _ in range(count):
+            cell = take()
+            guarded = guarded_by(cell) if cell is not None else None
+            if guarded is None:
+                continue
+
+            trap = {"type": trap_type, "can_attack": trap_type != "Saw", "pos": ids[cell], "guards": ids[guarded]}
+            trapped.update((cell, guarded))
+            if trap["can_attack"]:
+                targets.append(cell)
+            if trap_type in ("Saw", "Spider"):
+                trap["moving_seq"] = patrol(cell)
+            elif trap_type == "Lizard":
+                trap["activates"] = ids[rng.choice(sorted(path))]
+            traps_json.append(trap)
+
+    air = {}
+    items_json = []
+    for _ in range(spears):
+        cell = take()
+        if cell is None:
+            break
+        items_json.append({"type": "Spear", "pos": ids[cell]})
+
+        reachable_targets = [target for target in targets if target[2] == cell[2]]
+        if len(reachable_targets) == 0:
+            continue
+        target = rng.choice(reachable_targets)
+        throw = cell
+        for x, y in route(cell[:2], target[:2], rng):
+            tile = (x, y, cell[2])
+            if tile in cells and tile not in trapped:
+                throw = tile
+        air.setdefault(throw, []).append(ids[target])
+
+    tiles_json = []
+    for cell, t_id in sorted(ids.items(), key=lambda item: item[1]):
+        tile = cells[cell]
+        tile_json = {"id": t_id, "type": tile["type"]}
+        for direction, key in (("l", "left"), ("r", "right"), ("u", "up"), ("d", "down")):
+            neighbor = neighbor_of(cell, direction)
+            tile_json[key] = ids[neighbor] if neighbor is not None else None
+        tile_json["air_connect"] = air.get(cell, [])
+        tile_json["is_goal"] = tile.get("is_goal", False)
+        if tile["type"] == "CrackedTile":
+            drop = drops.get(cell)
+            tile_json["drop"] = ids[drop] if drop in ids else None
+        elif tile["type"] == "MovingTile":
+            tile_json["active"] = tile["active"]
+        tiles_json.append(tile_json)
+
+    return {"tiles": tiles_json, "agent": {"pos": ids[start]}, "traps": traps_json, "items": items_json,
+            "levers": levers_json}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a random Lara Croft Go level")
+    parser.add_argument("--width", type=int, default=10, help="grid width (default: 10)")
+    parser.add_argument("--height", type=int, default=10, help="grid height (default: 10)")
+    parser.add_argument("--levels", type=int, default=1, help="number of z levels (default: 1)")
+    parser.add_argument("--density", type=float, default=0.85, help="probability of a tile in a cell (default: 0.85)")
+    parser.add_argument("--cracked", type=int, default=0, help="number of extra cracked tiles")
+    parser.add_argument("--moving", type=int, default=0, help="number of moving tiles")
+    parser.add_argument("--levers", type=int, default=0, help="number of levers")
+    parser.add_argument("--snakes", type=int, default=0, help="number of snakes")
+    parser.add_argument("--saws", type=int, default=0, help="number of saws")
+    parser.add_argument("--spiders", type=int, default=0, help="number of spiders")
+    parser.add_argument("--lizards", type=int, default=0, help="number of lizards")
+    parser.add_argument("--spears", type=int, default=0, help="number of spears")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for reproducible output")
+    parser.add_argument("--output", default=None, help="level file (default: standard output)")
+    args = parser.parse_args()
+
+    level = generate_level(args.width, args.height, args.levels, args.cracked, args.moving, args.levers, args.snakes,
+                           args.saws, args.spiders, args.lizards, args.spears, args.density, args.seed)
+    if args.output is None:
+        json.dump(level, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as out:
+            json.dump(level, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
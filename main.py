@@ -1,137 +1,1173 @@
-from queue import PriorityQueue
-from typing import List, Tuple
-
-from model.Agent import Action
-from model.Game import Game
-from model.Tiles import CrackedTile, AbstractTile, MovingTile
-import sys
-import copy
+from enum import Enum
+import multiprocessing
+from queue import Empty
+from typing import List, NamedTuple, Optional
+
+from model.Agent import Action, Agent
+from model.Game import Game, COMPILED_SUFFIX
+from model.Level import Level, UNREACHABLE
+from model.State import State, TRAP_POS
+from solution_cache import SolutionCache, DEFAULT_CACHE
+import argparse
+import heapq
+import itertools
+import json
+import math
+import os
+import threading
 import time
 
-from model.Trap import SawStrategy
 
+class SearchNode(NamedTuple):
+    state: State
+    parent: int
+    action: Action
+    g: int
+
+
+def action_cost(action) -> int:
+    """An action is a single Action or a corridor macro, a tuple of the moves it stands for."""
+    return len(action) if isinstance(action, tuple) else 1
+
+
+def extract_plan(nodes: List[SearchNode], node_id: int) -> List[Action]:
+    plan = []
+    node = nodes[node_id]
+    while node.parent is not None:
+        if isinstance(node.action, tuple):
+            plan.extend(reversed(node.action))
+        else:
+            plan.append(node.action)
+        node = nodes[node.parent]
+    plan.reverse()
+    return plan
+
+
+class Algorithm(Enum):
+    ASTAR = "astar"
+    BFS = "bfs"
+    WEIGHTED_ASTAR = "wastar"
+    GREEDY = "greedy"
+    IDA_STAR = "idastar"
+    SMA_STAR = "smastar"
+    ANYTIME = "anytime"
+
+
+class BucketQueue:
+    """Open list of (f, h) buckets served lowest key first, last in first out within a bucket.
+
+    Search keys take few distinct values, so only the keys of non empty buckets go through the heap. Entries are
+    never removed or updated, a search skips the stale ones it pops (lazy deletion).
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.keys = []
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def empty(self) -> bool:
+        return self.size == 0
+
+    def put(self, f, h, item):
+        key = (f, h)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = []
+            heapq.heappush(self.keys, key)
+        bucket.append(item)
+        self.size += 1
+
+    def peek(self):
+        """Key of the next entry, None once empty."""
+        return self.keys[0] if self.size > 0 else None
+
+    def get(self):
+        """Removes and returns (f, h, item) of the next entry."""
+        key = self.keys[0]
+        bucket = self.buckets[key]
+        item = bucket.pop()
+        if len(bucket) == 0:
+            heapq.heappop(self.keys)
+            del self.buckets[key]
+        self.size -= 1
+        return key[0], key[1], item
+
+
+class DominanceIndex:
+    """Seen states grouped by everything but their resources: the carried item, the items left on tiles and the
+    remaining air connections.
+
+    A state is dominated by a seen state of its group reached at no higher g that carries the same item (or any
+    item when the state carries none), leaves a superset of its items on the tiles and keeps the air connections
+    the state could still throw along. Whatever the weaker state can do, the stronger one can too. A spear always
+    flies along the last remaining connection of a tile, so more remaining connections only count as more options
+    where the weaker state has none left, or no spear to throw at all.
+    """
 
-class Solver:
     def __init__(self):
-        self._state_id = 0
+        self.seen = {}
+
+    @staticmethod
+    def group(state: State):
+        return state.agent, state.traps, state.cracked, state.destroyed, state.active
+
+    @staticmethod
+    def covers_air(air, state: State) -> bool:
+        if state.item is None and len(state.items) == 0:
+            return True
+        return all(count == other or other == 0 for count, other in zip(air, state.air))
+
+    def dominated(self, state: State, g: int) -> bool:
+        """True when a seen state dominates state, otherwise records state and returns False."""
+        entries = self.seen.setdefault(self.group(state), [])
+        for item, items, air, seen_g in entries:
+            if seen_g <= g and (state.item is None or item == state.item) and items >= state.items and \
+                    self.covers_air(air, state):
+                return True
+        entries.append((state.item, state.items, state.air, g))
+        return False
+
+
+SMA_NODE_BYTES = 1024
+IDA_TABLE_SIZE = 1 << 20
+
+
+class SmaNode:
+    """Node of the tree kept by SMA*, forgotten maps the actions of evicted children to their backed up f."""
+
+    def __init__(self, state: State, parent, action: Action, g: int, f: float):
+        self.state = state
+        self.parent = parent
+        self.action = action
+        self.g = g
+        self.f = f
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.children = {}
+        self.forgotten = {}
+        self.expanded = False
+        self.in_open = False
+        self.version = 0
+
+    def on_path(self, state: State) -> bool:
+        node = self
+        while node is not None:
+            if node.state == state:
+                return True
+            node = node.parent
+        return False
+
+    def plan(self) -> List[Action]:
+        plan = []
+        node = self
+        while node.parent is not None:
+            plan.append(node.action)
+            node = node.parent
+        plan.reverse()
+        return plan
+
+
+class SearchResult(NamedTuple):
+    plan: List[Action]
+    expanded: int
+    generated: int
+    pruned: int = 0
+    bound: Optional[float] = None
+
+
+class SearchStats:
+    """Counters of one search, phase_time is only filled when the Solver profiles (phases may nest)."""
+
+    def __init__(self):
+        self.expanded = 0
+        self.generated = 0
+        self.pruned = 0
+        self.duplicates = 0
+        self.dominated = 0
+        self.evicted = 0
+        self.max_open = 0
+        self.branching = {}
+        self.phase_time = {}
+        self.time = 0.0
+        self.cached = False
+
+    def record_branching(self, children: int):
+        self.branching[children] = self.branching.get(children, 0) + 1
+
+    def add_time(self, phase: str, elapsed: float):
+        self.phase_time[phase] = self.phase_time.get(phase, 0.0) + elapsed
 
-        self.forbidden_pos = []
+    def merge(self, other):
+        self.expanded += other.expanded
+        self.generated += other.generated
+        self.pruned += other.pruned
+        self.duplicates += other.duplicates
+        self.dominated += other.dominated
+        self.evicted += other.evicted
+        self.max_open = max(self.max_open, other.max_open)
+        for children, count in other.branching.items():
+            self.branching[children] = self.branching.get(children, 0) + count
+        for phase, elapsed in other.phase_time.items():
+            self.add_time(phase, elapsed)
+
+    def as_dict(self) -> dict:
+        expansions = sum(self.branching.values())
+        children = sum(n * count for n, count in self.branching.items())
+        return {"expanded": self.expanded, "generated": self.generated, "pruned": self.pruned,
+                "duplicates": self.duplicates, "dominated": self.dominated, "evicted": self.evicted,
+                "max_open": self.max_open, "time": self.time, "cached": self.cached,
+                "branching": {"min": min(self.branching, default=0), "max": max(self.branching, default=0),
+                              "mean": children / expansions if expansions > 0 else 0.0,
+                              "histogram": {str(n): self.branching[n] for n in sorted(self.branching)}},
+                "phase_time": dict(sorted(self.phase_time.items()))}
+
+    def result(self, plan: List[Action], bound: Optional[float] = None) -> SearchResult:
+        return SearchResult(plan, self.expanded, self.generated, self.pruned, bound)
+
+
+PROFILED_ATTRIBUTES = ("current", "get_neighbor_state", "forbidden_tiles", "is_forbidden_action", "simulate",
+                       "is_hopeless", "heuristic")
+
+
+def timed(owner, phase: str, function):
+    """Wraps function to add its run time under phase to the stats of the search running in the current thread."""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            owner.current.stats.add_time(phase, time.perf_counter() - start)
+    return wrapper
+
+
+def state_owner(state: State, workers: int) -> int:
+    """Worker owning a state in parallel search, stable across processes regardless of hash randomization.
+
+    The carried item, items left and spears left are not hashed, so states one may dominate in resources meet in
+    the DominanceIndex of the same worker."""
+    key = (-1 if state.agent is None else state.agent, state.active, state.cracked, state.destroyed,
+           tuple(trap[TRAP_POS] for trap in state.traps))
+    return hash(key) % workers
+
+
+HDA_POLL_SECONDS = 1.0
+
+
+class HdaShared:
+    """Synchronisation shared by the workers of one hash-distributed A* run."""
+
+    def __init__(self, context, workers: int):
+        self.workers = workers
+        self.queues = [context.Queue() for _ in range(workers)]
+        self.results = context.Queue()
+        self.barrier = context.Barrier(workers)
+        self.incumbent = context.Value('d', math.inf)
+        self.min_f = context.Array('d', workers)
+        self.sent = context.Array('i', workers * workers)
+
+
+def hda_star_worker(solver, level: Level, start: State, worker: int, shared: HdaShared, batch: int):
+    """Runs hda_star_rounds and puts (plan, stats, error) on shared.results.
+
+    A failing worker aborts the barrier, so the other workers leave their rounds (reporting no error of their own)
+    instead of waiting for it forever.
+    """
+    stats = SearchStats()
+    plan, error = None, None
+    try:
+        plan = hda_star_rounds(solver, level, start, worker, shared, batch, stats)
+    except threading.BrokenBarrierError:
+        pass
+    except Exception as e:
+        shared.barrier.abort()
+        error = "worker %d: %r" % (worker, e)
+    shared.results.put((plan, stats, error))
+
+
+def hda_star_rounds(solver, level: Level, start: State, worker: int, shared: HdaShared, batch: int,
+                    stats: SearchStats):
+    """Expands the states owned by worker in rounds of at most batch states.
+
+    Children owned by other workers are sent to them at the end of the round, the sent counters tell every worker
+    how many messages to wait for. The run ends once no open state can beat the best plan found (or, for the
+    inadmissible algorithms, as soon as any plan is found).
+    """
+    workers = shared.workers
+    optimal = solver.algorithm in (Algorithm.ASTAR, Algorithm.BFS)
+    nodes = []
+    best_g = {}
+    dominance = solver.dominance_index(level, start)
+    queue = solver.open_list()
+    solver.track(stats)
+    best_plan = None
+    received = 0
+
+    def push(state, g, plan):
+        if best_g.get(state, g + 1) <= g:
+            stats.duplicates += 1
+            return
+        if dominance is not None and dominance.dominated(state, g):
+            stats.dominated += 1
+            return
+        best_g[state] = g
+        h = solver.heuristic(level, state)
+        nodes.append((state, g, plan))
+        queue.put(solver.priority(g, h), h, len(nodes) - 1)
+        stats.max_open = max(stats.max_open, len(queue))
+
+    if state_owner(start, workers) == worker:
+        push(start, 0, ())
+
+    while True:
+        outbox = [[] for _ in range(workers)]
+        expanded = 0
+        while expanded < batch and not queue.empty():
+            if queue.peek()[0] >= shared.incumbent.value:
+                break
+            _, _, curr_id = queue.get()
+            state, g, plan = nodes[curr_id]
+            if g > best_g[state]:
+                stats.duplicates += 1
+                continue
+            stats.expanded += 1
+            expanded += 1
+
+            if level.is_goal(state):
+                with shared.incumbent.get_lock():
+                    if g < shared.incumbent.value:
+                        shared.incumbent.value = g
+                        best_plan = plan
+                continue
+
+            for action, neighbor in solver.get_neighbor_state(level, state, plan[-1] if plan else None, stats):
+                stats.generated += 1
+                owner = state_owner(neighbor, workers)
+                if owner == worker:
+                    push(neighbor, g + 1, plan + (action,))
+                else:
+                    outbox[owner].append((neighbor, g + 1, plan + (action,)))
+
+        for owner, messages in enumerate(outbox):
+            if len(messages) > 0:
+                shared.queues[owner].put(messages)
+                shared.sent[worker * workers + owner] += 1
+
+        shared.barrier.wait()
+        expected = sum(shared.sent[sender * workers + worker] for sender in range(workers))
+        while received < expected:
+            for state, g, plan in shared.queues[worker].get():
+                push(state, g, plan)
+            received += 1
+
+        shared.min_f[worker] = queue.peek()[0] if not queue.empty() else math.inf
+        shared.barrier.wait()
+        incumbent = shared.incumbent.value
+        done = min(shared.min_f) >= incumbent or (not optimal and incumbent < math.inf)
+        shared.barrier.wait()
+        if done:
+            break
+
+    if best_plan is not None and shared.incumbent.value < len(best_plan):
+        best_plan = None
+    return best_plan
+
+
+class Solver:
+    def __init__(self, algorithm: Algorithm = Algorithm.ASTAR, weight: float = 1.0, workers: int = 1, cache=None,
+                 profile: bool = False, stats_hook=None, memory_nodes: Optional[int] = None, macros: bool = True,
+                 time_budget: Optional[float] = None, max_expansions: Optional[int] = None):
+        self.algorithm = algorithm
+        self.weight = weight
+        self.workers = workers
+        self.cache = cache
+        self.memory_nodes = memory_nodes
+        self.macros = macros
+        self.time_budget = time_budget
+        self.max_expansions = max_expansions
+        self.profile = profile
+        self.stats_hook = stats_hook
+        self.stats = SearchStats()
+
+        self.simulate = Agent.apply_action_to_state
+        self.is_hopeless = Level.is_hopeless
+        if profile:
+            self.enable_profiling()
+
+    def enable_profiling(self):
+        """Times the search phases through instance attributes, so a solver without profiling pays nothing."""
+        self.current = threading.local()
+        self.get_neighbor_state = timed(self, "successors", self.get_neighbor_state)
+        self.forbidden_tiles = timed(self, "forbidden", self.forbidden_tiles)
+        self.is_forbidden_action = timed(self, "forbidden", self.is_forbidden_action)
+        self.simulate = timed(self, "simulate", self.simulate)
+        self.is_hopeless = timed(self, "prune", self.is_hopeless)
+        self.heuristic = timed(self, "heuristic", self.heuristic)
+
+    def __getstate__(self):
+        """Profiling wrappers cannot be pickled, a solver sent to a worker process wraps its phases again."""
+        state = dict(self.__dict__)
+        if self.profile:
+            for name in PROFILED_ATTRIBUTES:
+                state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.profile:
+            self.simulate = Agent.apply_action_to_state
+            self.is_hopeless = Level.is_hopeless
+            self.enable_profiling()
+
+    def track(self, stats: SearchStats):
+        if self.profile:
+            self.current.stats = stats
+
+    def open_list(self) -> BucketQueue:
+        queue = BucketQueue()
+        if self.profile:
+            queue.put = timed(self, "queue", queue.put)
+            queue.get = timed(self, "queue", queue.get)
+        return queue
 
     @staticmethod
-    def heuristic(state: Game):
-        goal_pos: AbstractTile = state.goal
-        curr_pos: AbstractTile = state.agent.current_position
-
-        g_x, g_y, g_z = goal_pos.x, goal_pos.y, goal_pos.z
-        x, y, z = curr_pos.x, curr_pos.y, curr_pos.z
-
-        dx = abs(x - g_x)
-        dy = abs(y - g_y)
-        dz = abs(z - g_z)
-        return 1 * (dx + dy + dz)
-
-    def search(self, game: Game) -> Tuple[List[Action], int]:
-        state_id = copy.deepcopy(self._state_id)
-        states = {state_id: game}
-
-        queue = PriorityQueue()
-        s_h = self.heuristic(game)
-        queue.put((0 + s_h, s_h, state_id, []))
-        closed = []
+    def dominance_index(level: Level, start: State) -> Optional[DominanceIndex]:
+        """Index for dominance pruning, None on levels without items where every group holds a single state."""
+        if not level.has_items and start.item is None:
+            return None
+        return DominanceIndex()
+
+    @staticmethod
+    def heuristic(level: Level, state: State):
+        if state.agent is None:
+            return math.inf
+
+        distance = level.goal_distance[state.agent]
+        if distance == UNREACHABLE:
+            return math.inf
+        return distance
+
+    def priority(self, g, h):
+        if self.algorithm == Algorithm.BFS:
+            return g
+        elif self.algorithm == Algorithm.GREEDY:
+            return h
+        elif self.algorithm == Algorithm.WEIGHTED_ASTAR:
+            return g + self.weight * h
+        return g + h
+
+    def cache_settings(self) -> str:
+        """Every setting that can change the plan found, part of the solution cache key."""
+        settings = [self.algorithm.value]
+        if self.algorithm in (Algorithm.WEIGHTED_ASTAR, Algorithm.ANYTIME):
+            settings.append(str(self.weight))
+        if not self.macros:
+            settings.append("no-macros")
+        for name in ("memory_nodes", "time_budget", "max_expansions"):
+            if getattr(self, name) is not None:
+                settings.append(name + "=" + str(getattr(self, name)))
+        return ":".join(settings)
+
+    def search(self, game: Game, cancel=None) -> SearchResult:
+        """Solves game, safe to call from several threads at once; self.stats holds the last finished search.
+
+        With a cache, concurrent calls must get different games: a cached plan is validated by replaying it on game.
+
+        The anytime search stops early once cancel (a threading.Event) is set.
+        """
+        start = time.perf_counter()
+        stats = SearchStats()
+        result = None
+        if self.cache is not None:
+            cached = self.cache.get(game, self.cache_settings())
+            if cached is not None:
+                result = SearchResult(*cached)
+                stats.expanded, stats.generated, stats.pruned = result[1:4]
+                stats.cached = True
+
+        if result is None:
+            result = self.search_level(game, stats, cancel)
+            if self.cache is not None and (result.bound is None or result.bound == (len(result.plan) if result.plan
+                                                                                     else math.inf)):
+                self.cache.put(game, self.cache_settings(), result.plan, result.expanded, result.generated,
+                               result.pruned)
+
+        stats.time = time.perf_counter() - start
+        self.stats = stats
+        if self.stats_hook is not None:
+            self.stats_hook(stats)
+        return result
+
+    def search_level(self, game: Game, stats: SearchStats = None, cancel=None) -> SearchResult:
+        if stats is None:
+            stats = SearchStats()
+        self.track(stats)
+        level = game.compiled_level()
+        start = level.state_of(game)
+        if self.algorithm == Algorithm.IDA_STAR:
+            return self.ida_star_search(level, start, stats)
+        if self.algorithm == Algorithm.SMA_STAR:
+            return self.sma_star_search(level, start, stats)
+        if self.algorithm == Algorithm.ANYTIME:
+            return self.anytime_search(level, start, stats, cancel)
+        if self.workers > 1:
+            return self.parallel_search(level, start, stats)
+        return self.best_first_search(level, start, stats)
+
+    def best_first_search(self, level: Level, start: State, stats: SearchStats = None) -> SearchResult:
+        nodes = [SearchNode(start, None, None, 0)]
+        best_g = {start: 0}
+        dominance = self.dominance_index(level, start)
+
+        queue = self.open_list()
+        s_h = self.heuristic(level, start)
+        queue.put(self.priority(0, s_h), s_h, 0)
+        stats = stats if stats is not None else SearchStats()
+        while not queue.empty():
+            f, h, curr_id = queue.get()
+            curr = nodes[curr_id]
+            if curr.g > best_g[curr.state]:
+                stats.duplicates += 1
+                continue
+            stats.expanded += 1
+
+            if level.is_goal(curr.state):
+                return stats.result(extract_plan(nodes, curr_id))
+
+            for action, neighbor in self.get_neighbor_state(level, curr.state, curr.action, stats, self.macros):
+                stats.generated += 1
+                neighbor_g = curr.g + action_cost(action)
+                if best_g.get(neighbor, neighbor_g + 1) <= neighbor_g:
+                    stats.duplicates += 1
+                    continue
+                if dominance is not None and dominance.dominated(neighbor, neighbor_g):
+                    stats.dominated += 1
+                    continue
+                best_g[neighbor] = neighbor_g
+
+                neighbor_h = self.heuristic(level, neighbor)
+                neighbor_f = self.priority(neighbor_g, neighbor_h)
+                nodes.append(SearchNode(neighbor, curr_id, action, neighbor_g))
+
+                queue.put(neighbor_f, neighbor_h, len(nodes) - 1)
+            if len(queue) > stats.max_open:
+                stats.max_open = len(queue)
+        return stats.result([])
+
+    def anytime_search(self, level: Level, start: State, stats: SearchStats = None, cancel=None) -> SearchResult:
+        """Anytime weighted A*: weighted A* starting at self.weight that lowers the weight by 0.5 after every plan
+        it finds, pruning states that cannot beat the best plan so far, until the open list runs empty.
+
+        Stops early at self.time_budget seconds, self.max_expansions expanded states or once cancel is set. The
+        result holds the best plan found and bound, a proven lower bound on the length of an optimal plan (equal to
+        the plan length once it is proven optimal, infinite when the level is proven unsolvable).
+        """
+        deadline = time.perf_counter() + self.time_budget if self.time_budget is not None else math.inf
+        max_expansions = self.max_expansions if self.max_expansions is not None else math.inf
+        stats = stats if stats is not None else SearchStats()
+
+        nodes = [SearchNode(start, None, None, 0)]
+        best_g = {start: 0}
+        dominance = self.dominance_index(level, start)
+        weight = max(1.0, self.weight)
+        queue = self.open_list()
+        s_h = self.heuristic(level, start)
+        queue.put(s_h * weight, s_h, 0)
+        plan, cost = [], math.inf
+
         while not queue.empty():
-            f, h, curr_id, actions = queue.get()
-            g = f - h
+            if stats.expanded >= max_expansions or time.perf_counter() >= deadline or \
+                    cancel is not None and cancel.is_set():
+                return stats.result(plan, min(cost, self.open_bound(queue, nodes, best_g)))
+
+            _, h, curr_id = queue.get()
+            curr = nodes[curr_id]
+            if curr.g > best_g[curr.state]:
+                stats.duplicates += 1
+                continue
+            if curr.g + h >= cost:
+                stats.pruned += 1
+                continue
+            stats.expanded += 1
+
+            if level.is_goal(curr.state):
+                plan, cost = extract_plan(nodes, curr_id), curr.g
+                if weight == 1.0:
+                    break
+                weight = max(1.0, weight - 0.5)
+                previous, queue = queue, self.open_list()
+                for (_, entry_h), entries in previous.buckets.items():
+                    for node_id in entries:
+                        node = nodes[node_id]
+                        if node.g == best_g[node.state] and node.g + entry_h < cost:
+                            queue.put(node.g + weight * entry_h, entry_h, node_id)
+                continue
+
+            for action, neighbor in self.get_neighbor_state(level, curr.state, curr.action, stats, self.macros):
+                stats.generated += 1
+                neighbor_g = curr.g + action_cost(action)
+                if best_g.get(neighbor, neighbor_g + 1) <= neighbor_g:
+                    stats.duplicates += 1
+                    continue
+                neighbor_h = self.heuristic(level, neighbor)
+                if neighbor_g + neighbor_h >= cost:
+                    stats.pruned += 1
+                    continue
+                if dominance is not None and dominance.dominated(neighbor, neighbor_g):
+                    stats.dominated += 1
+                    continue
+                best_g[neighbor] = neighbor_g
+
+                nodes.append(SearchNode(neighbor, curr_id, action, neighbor_g))
+                queue.put(neighbor_g + weight * neighbor_h, neighbor_h, len(nodes) - 1)
+            if len(queue) > stats.max_open:
+                stats.max_open = len(queue)
+        return stats.result(plan, cost)
+
+    @staticmethod
+    def open_bound(queue: BucketQueue, nodes: List[SearchNode], best_g: dict) -> float:
+        """Lowest g + h over the live entries of an open list, a lower bound on any plan through them."""
+        bound = math.inf
+        for (_, h), entries in queue.buckets.items():
+            for node_id in entries:
+                node = nodes[node_id]
+                if node.g == best_g[node.state]:
+                    bound = min(bound, node.g + h)
+        return bound
+
+    def parallel_search(self, level: Level, start: State, stats: SearchStats = None, batch: int = 64) -> SearchResult:
+        """Hash-distributed A*: each of self.workers processes owns the states mapped to it by state_owner."""
+        context = multiprocessing.get_context()
+        shared = HdaShared(context, self.workers)
+        solver = Solver(self.algorithm, self.weight, profile=self.profile)
+        processes = [context.Process(target=hda_star_worker, args=(solver, level, start, worker, shared, batch))
+                     for worker in range(self.workers)]
+        for process in processes:
+            process.start()
+
+        stats = stats if stats is not None else SearchStats()
+        plan, failure = None, None
+        reported = 0
+        while reported < len(processes):
+            try:
+                worker_plan, worker_stats, error = shared.results.get(timeout=HDA_POLL_SECONDS)
+            except Empty:
+                # a worker killed outright never reports: abort the barrier the others are waiting on
+                crashed = [process.exitcode for process in processes if process.exitcode not in (None, 0)]
+                if crashed and failure is None:
+                    failure = "worker exited with code %d" % crashed[0]
+                    shared.barrier.abort()
+                if all(process.exitcode is not None for process in processes):
+                    break
+                continue
+            reported += 1
+            stats.merge(worker_stats)
+            failure = failure or error
+            if worker_plan is not None and (plan is None or len(worker_plan) < len(plan)):
+                plan = worker_plan
+        for process in processes:
+            process.join()
+        if failure is not None or shared.barrier.broken:
+            raise RuntimeError("hash-distributed search failed: " + (failure or "barrier aborted"))
+        return stats.result(list(plan) if plan is not None else [])
+
+    def ida_star_search(self, level: Level, start: State, stats: SearchStats = None) -> SearchResult:
+        """IDA*: depth-first searches with a growing bound on f.
+
+        Each iteration keeps a transposition table of at most IDA_TABLE_SIZE states with the lowest g they were
+        reached at and skips a state reached again at an equal or higher g. Stops early at self.time_budget seconds
+        or self.max_expansions expanded states, returning no plan and the current bound as a lower bound.
+        """
+        deadline = time.perf_counter() + self.time_budget if self.time_budget is not None else math.inf
+        max_expansions = self.max_expansions if self.max_expansions is not None else math.inf
+        bound = self.heuristic(level, start)
+        stats = stats if stats is not None else SearchStats()
+        if level.is_goal(start):
+            stats.expanded += 1
+            return stats.result([])
+
+        while True:
+            next_bound = None
+            path = {start}
+            best_g = {start: 0}
+            stack = [(start, None, iter(self.get_neighbor_state(level, start, None, stats)))]
+            stats.expanded += 1
+
+            while len(stack) > 0:
+                if stats.expanded >= max_expansions or time.perf_counter() >= deadline:
+                    return stats.result([], bound)
 
-            curr = states.get(curr_id)
-            closed.append(curr)
+                state, action, children = stack[-1]
+                for child_action, child in children:
+                    stats.generated += 1
+                    child_g = len(stack)
+                    if child in path or best_g.get(child, child_g + 1) <= child_g:
+                        stats.duplicates += 1
+                        continue
 
-            if curr.agent.current_position.is_goal:
-                return actions, len(closed)
+                    child_f = child_g + self.heuristic(level, child)
+                    if child_f > bound:
+                        if next_bound is None or child_f < next_bound:
+                            next_bound = child_f
+                        continue
 
-            prev_action = None
-            if len(actions) != 0:
-                prev_action = actions[-1]
+                    if level.is_goal(child):
+                        plan = [frame[1] for frame in stack[1:]]
+                        plan.append(child_action)
+                        return stats.result(plan)
 
-            for action, neighbor in self.get_neighbor_state(curr, prev_action):
-                self._state_id += 1
-                neighbor_id = self._state_id
-                states.update({neighbor_id: neighbor})
+                    path.add(child)
+                    if len(best_g) < IDA_TABLE_SIZE or child in best_g:
+                        best_g[child] = child_g
+                    stack.append((child, child_action, iter(self.get_neighbor_state(level, child, child_action, stats))))
+                    stats.expanded += 1
+                    stats.max_open = max(stats.max_open, len(stack))
+                    break
+                else:
+                    stack.pop()
+                    path.discard(state)
 
-                if neighbor in closed:
+            if next_bound is None or next_bound == math.inf:
+                return stats.result([])
+            bound = next_bound
+
+    def sma_star_search(self, level: Level, start: State, stats: SearchStats = None) -> SearchResult:
+        """SMA*: A* over a tree of at most self.memory_nodes nodes.
+
+        When memory is full the worst leaf (highest f, shallowest) is evicted and its f is remembered by its parent,
+        which goes back to the open list to regenerate its best forgotten children later. States already in memory with a g no worse are not
+        stored twice. Plans are optimal whenever the optimal plan fits into the budget. A path of the tree holds at
+        most budget - 1 moves, so once the lowest f left reaches the budget no plan fits and the search gives up.
+        """
+        budget = self.memory_nodes if self.memory_nodes is not None else math.inf
+        stats = stats if stats is not None else SearchStats()
+        counter = itertools.count()
+        best, worst = [], []
+
+        def open_push(node: SmaNode):
+            node.version += 1
+            node.in_open = True
+            heapq.heappush(best, (node.f, -node.depth, next(counter), node.version, node))
+            heapq.heappush(worst, (-node.f, node.depth, next(counter), node.version, node))
+
+        def open_remove(node: SmaNode):
+            node.version += 1
+            node.in_open = False
+
+        def backup(node: SmaNode):
+            while node is not None and node.expanded:
+                successors_f = [child.f for child in node.children.values()] + list(node.forgotten.values())
+                new_f = min(successors_f, default=math.inf)
+                if new_f == node.f:
+                    break
+                node.f = new_f
+                if node.in_open:
+                    open_push(node)
+                node = node.parent
+
+        def evict(expanding: SmaNode) -> bool:
+            skipped = []
+            evicted = False
+            while len(worst) > 0:
+                entry = heapq.heappop(worst)
+                node = entry[-1]
+                if entry[3] != node.version or not node.in_open:
                     continue
+                if node is expanding or node.parent is None or len(node.children) > 0:
+                    skipped.append(entry)
+                    continue
+
+                parent = node.parent
+                del parent.children[node.action]
+                parent.forgotten[node.action] = min(parent.forgotten.get(node.action, math.inf), node.f)
+                open_remove(node)
+                if in_memory.get(node.state) is node:
+                    del in_memory[node.state]
+                if not parent.in_open:
+                    open_push(parent)
+                stats.evicted += 1
+                evicted = True
+                break
+
+            for entry in skipped:
+                heapq.heappush(worst, entry)
+            return evicted
 
-                neighbor_h = self.heuristic(neighbor)
-                neighbor_g = g + 1
-                neighbor_f = neighbor_h + neighbor_g
-                neighbor_actions = actions.copy()
-                neighbor_actions.append(action)
+        root = SmaNode(start, None, None, 0, self.heuristic(level, start))
+        in_memory = {start: root}
+        used = 1
+        open_push(root)
+        while len(best) > 0:
+            entry = heapq.heappop(best)
+            node = entry[-1]
+            if entry[3] != node.version or not node.in_open:
+                continue
+            if node.f >= budget:
+                break
+            open_remove(node)
+            stats.expanded += 1
 
-                queue.put((neighbor_f, neighbor_h, neighbor_id, neighbor_actions))
-        return [], len(closed)
+            if level.is_goal(node.state):
+                return stats.result(node.plan())
 
-    def get_neighbor_state(self, state: Game, prev_action: Action):
+            regenerate = None
+            if node.expanded:
+                forgotten_f = min(node.forgotten.values(), default=math.inf)
+                regenerate = {action for action, f in node.forgotten.items() if f == forgotten_f}
+
+            for action, child_state in self.get_neighbor_state(level, node.state, node.action, stats):
+                if action in node.children or (regenerate is not None and action not in regenerate):
+                    continue
+                stats.generated += 1
+                child_g = node.g + 1
+                known = in_memory.get(child_state)
+                if node.on_path(child_state) or (known is not None and known.g <= child_g):
+                    stats.duplicates += 1
+                    node.forgotten.pop(action, None)
+                    continue
+
+                child_f = max(node.f, child_g + self.heuristic(level, child_state))
+                if node.depth + 1 >= budget - 1 and not level.is_goal(child_state):
+                    child_f = math.inf
+
+                while used >= budget and evict(node):
+                    used -= 1
+                if used >= budget:
+                    node.forgotten[action] = child_f
+                    continue
+
+                child = SmaNode(child_state, node, action, child_g, child_f)
+                node.children[action] = child
+                node.forgotten.pop(action, None)
+                in_memory[child_state] = child
+                used += 1
+                open_push(child)
+            stats.max_open = max(stats.max_open, used)
+
+            node.expanded = True
+            backup(node)
+            if len(node.forgotten) > 0 or len(node.children) == 0:
+                open_push(node)
+        return stats.result([])
+
+    def get_neighbor_state(self, level: Level, state: State, prev_action: Action, stats: SearchStats = None,
+                           macros: bool = False):
+        """Successors of state as (action, state) pairs, with macros moves into corridors walk them to the end."""
         neighbor_states = []
-        self.set_forbidden_pos(state)
+        forbidden = self.forbidden_tiles(level, state)
+        corridors = None
+        if macros and state.agent is not None and level.macros[state.agent] is not None and \
+                level.allows_macros(state):
+            corridors = level.macros[state.agent]
 
         for action in Action:
-            n = state.clone()
-            if not self.is_forbidden_action(action, n, prev_action) and n.agent.apply_action(action, n.traps):
-                neighbor_states.append((action, n))
+            if corridors is not None and action in corridors:
+                action = corridors[action]
+                n = self.walk(level, state, action, forbidden)
+            elif not self.is_forbidden_action(level, action, state, prev_action, forbidden):
+                n = self.simulate(level, state, action)
+            else:
+                continue
+            if n is None:
+                continue
+
+            if self.is_hopeless(level, n):
+                if stats is not None:
+                    stats.pruned += 1
+                continue
+            neighbor_states.append((action, n))
 
+        if stats is not None:
+            stats.record_branching(len(neighbor_states))
         return neighbor_states
 
-    def set_forbidden_pos(self, state: Game):
-        self.forbidden_pos = []
-
-        for tile in state.tiles.values():
-            if isinstance(tile, CrackedTile) and tile.is_cracked_without_drop_tile():
-                self.forbidden_pos.append((tile.x, tile.y, tile.z))
-            if tile.trap_on_tile is not None:
-                trap = tile.trap_on_tile
-                if isinstance(trap.trap_strategy, SawStrategy):
-                    self.forbidden_pos.append((tile.x, tile.y, tile.z))
-                elif trap.attack_able and trap.guarded_tile is not None:
-                    self.forbidden_pos.append((trap.guarded_tile.x, trap.guarded_tile.y, trap.guarded_tile.z))
-
-    def is_forbidden_action(self, action: Action, state: Game, prev_action: Action) -> bool:
-        x, y, z = state.agent.current_position.x, state.agent.current_position.y, state.agent.current_position.z
-        if action == Action.MOVE_UP:
-            return (x, y + 1, z) in self.forbidden_pos
-        elif action == Action.MOVE_DOWN:
-            return (x, y - 1, z) in self.forbidden_pos
-        elif action == Action.MOVE_RIGHT:
-            return (x + 1, y, z) in self.forbidden_pos
-        elif action == Action.MOVE_LEFT:
-            return (x - 1, y, z) in self.forbidden_pos
-        elif action == Action.USE_LEVER:
+    def walk(self, level: Level, state: State, moves, forbidden):
+        """State after all moves of a corridor macro, None when one of them is forbidden, fails or kills the agent."""
+        for move in moves:
+            if self.is_forbidden_action(level, move, state, None, forbidden):
+                return None
+            state = self.simulate(level, state, move)
+            if state is None or state.agent is None:
+                return None
+        return state
+
+    @staticmethod
+    def forbidden_tiles(level: Level, state: State):
+        return level.forbidden_tiles(state)
+
+    @staticmethod
+    def is_forbidden_action(level: Level, action: Action, state: State, prev_action: Action,
+                            forbidden=frozenset()) -> bool:
+        if state.agent is None:
+            return False
+
+        if action == Action.USE_LEVER:
             return prev_action == Action.USE_LEVER
+        elif action in level.coord_neighbors:
+            for tile in level.coord_neighbors[action][state.agent]:
+                if tile in forbidden:
+                    return True
 
         return False
 
 
+class Replanner:
+    """Plans the same Game again and again, reusing what earlier searches proved.
+
+    Every state along a found plan is remembered with its exact cost to the goal, so a start that moves along the
+    plan is answered from memory and a search from a nearby start ends as soon as it pops a remembered state (its
+    f is then an exact plan cost no open state can beat). States expanded by a search learn the admissible
+    heuristic plan cost - g, as in Adaptive A*. Both are tied to one compiled Level; once the Game is reloaded or
+    edited they are dropped and the previous plan, if it still solves the new level, bounds the new search.
+
+    Both are only exact for optimal plans, so the searches are A* over single moves whatever macros the solver
+    was given, and a solver set to any other algorithm is refused.
+    """
+
+    MAX_LEARNED = 1 << 20
+
+    def __init__(self, solver: Solver = None):
+        if solver is not None and solver.algorithm != Algorithm.ASTAR:
+            raise ValueError("replanning needs optimal plans from astar, not " + solver.algorithm.value)
+        self.solver = solver if solver is not None else Solver()
+        self.level = None
+        self.known = {}
+        self.learned = {}
+        self.last_plan = []
+        self.stats = SearchStats()
+
+    def reset(self, level: Level):
+        self.level = level
+        self.known = {}
+        self.learned = {}
+
+    def plan(self, game: Game) -> SearchResult:
+        level = game.compiled_level()
+        start = level.state_of(game)
+        stats = SearchStats()
+        self.stats = stats
+        self.solver.track(stats)
+        if level is not self.level:
+            self.reset(level)
+
+        if start in self.known:
+            return stats.result(self.suffix(start))
+
+        bound, incumbent = math.inf, self.replay(level, start, self.last_plan)
+        if incumbent is not None:
+            bound = len(incumbent)
+        result = self.search(level, start, stats, bound, incumbent)
+        if len(result.plan) > 0:
+            self.last_plan = result.plan
+        return result
+
+    def heuristic(self, level: Level, state: State):
+        known = self.known.get(state)
+        if known is not None:
+            return known[0]
+        return max(self.solver.heuristic(level, state), self.learned.get(state, 0))
+
+    def search(self, level: Level, start: State, stats: SearchStats, bound: float, incumbent) -> SearchResult:
+        """A* from start until it pops the goal or a known state, or until no open state can beat bound."""
+        solver = self.solver
+        nodes = [SearchNode(start, None, None, 0)]
+        best_g = {start: 0}
+        dominance = solver.dominance_index(level, start)
+        expanded = []
+
+        queue = solver.open_list()
+        s_h = self.heuristic(level, start)
+        queue.put(s_h, s_h, 0)
+        while not queue.empty():
+            f, h, curr_id = queue.get()
+            curr = nodes[curr_id]
+            if curr.g > best_g[curr.state]:
+                stats.duplicates += 1
+                continue
+            if f >= bound:
+                break
+            stats.expanded += 1
+            expanded.append(curr.state)
+
+            if level.is_goal(curr.state) or curr.state in self.known:
+                plan = extract_plan(nodes, curr_id) + self.suffix(curr.state)
+                self.learn(level, start, plan, expanded, best_g)
+                return stats.result(plan)
+
+            for action, neighbor in solver.get_neighbor_state(level, curr.state, curr.action, stats):
+                stats.generated += 1
+                neighbor_g = curr.g + 1
+                if best_g.get(neighbor, neighbor_g + 1) <= neighbor_g:
+                    stats.duplicates += 1
+                    continue
+                neighbor_h = self.heuristic(level, neighbor)
+                if neighbor_g + neighbor_h >= bound:
+                    stats.pruned += 1
+                    continue
+                if dominance is not None and dominance.dominated(neighbor, neighbor_g):
+                    stats.dominated += 1
+                    continue
+                best_g[neighbor] = neighbor_g
+
+                nodes.append(SearchNode(neighbor, curr_id, action, neighbor_g))
+                queue.put(neighbor_g + neighbor_h, neighbor_h, len(nodes) - 1)
+            if len(queue) > stats.max_open:
+                stats.max_open = len(queue)
+
+        if incumbent is not None:
+            self.learn(level, start, incumbent, expanded, best_g)
+            return stats.result(incumbent)
+        return stats.result([])
+
+    def learn(self, level: Level, start: State, plan: List[Action], expanded: List[State], best_g: dict):
+        cost = len(plan)
+        if len(self.learned) + len(expanded) > self.MAX_LEARNED:
+            self.learned = {}
+        for state in expanded:
+            self.learned[state] = max(self.learned.get(state, 0), cost - best_g[state])
+
+        state = start
+        for i, action in enumerate(plan):
+            following = self.solver.simulate(level, state, action)
+            if state not in self.known:
+                self.known[state] = (cost - i, action, following)
+            state = following
+        self.known[state] = (0, None, None)
+
+    def suffix(self, state: State) -> List[Action]:
+        if state not in self.known:
+            return []
+        plan = []
+        _, action, following = self.known[state]
+        while action is not None:
+            plan.append(action)
+            _, action, following = self.known[following]
+        return plan
+
+    def replay(self, level: Level, start: State, plan: List[Action]):
+        """plan when it still leads from start to the goal of level, otherwise None."""
+        if len(plan) == 0:
+            return None
+        state = start
+        for action in plan:
+            state = self.solver.simulate(level, state, action)
+            if state is None:
+                return None
+        return plan if level.is_goal(state) else None
+
+
+def watch(path: str, solver: Solver, interval: float = 0.5):
+    """Plans path again whenever the file changes, the previous plan bounds the search while it stays valid."""
+    replanner = Replanner(solver)
+    modified = None
+    while True:
+        try:
+            changed = os.stat(path).st_mtime_ns
+        except OSError:
+            changed = modified
+        if changed != modified:
+            modified = changed
+            game = Game()
+            try:
+                game.play(path)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                print("Could not load " + path + ": " + repr(e))
+                continue
+            start = time.time()
+            result = replanner.plan(game)
+            print("Plan of length %d, expanded %d states in %.4f seconds: %s" % (
+                len(result.plan), result.expanded, time.time() - start, " ".join(a.name for a in result.plan)))
+        time.sleep(interval)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Solve a Lara Croft Go level")
+    parser.add_argument("level", nargs="?", help="path to json representation of level to solve")
+    parser.add_argument("--algorithm", choices=[a.value for a in Algorithm], default=Algorithm.ASTAR.value,
+                        help="search algorithm (default: astar)")
+    parser.add_argument("--weight", type=float, default=2.0, help="heuristic weight for wastar (default: 2.0)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes for hash-distributed best-first search (default: 1)")
+    parser.add_argument("--memory-nodes", type=int, default=None, help="node budget of smastar")
+    parser.add_argument("--memory-mb", type=float, default=None,
+                        help="memory budget of smastar in MB, estimated at " + str(SMA_NODE_BYTES) + " bytes per node")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="seconds the anytime or idastar search may run before returning its best plan")
+    parser.add_argument("--max-expansions", type=int, default=None,
+                        help="expanded states after which the anytime or idastar search returns its best plan")
+    parser.add_argument("--no-macros", action="store_true",
+                        help="expand corridors one step at a time instead of as single macro-actions")
+    parser.add_argument("--stats", default=None,
+                        help="profile the search and write its statistics as json to this file ('-' for stdout)")
+    parser.add_argument("--compiled", action="store_true",
+                        help="reuse a compiled level written next to the json (<level>" + COMPILED_SUFFIX + ")")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and plan the level again every time its file changes")
+    parser.add_argument("--cache", nargs="?", const=DEFAULT_CACHE, default=None,
+                        help="reuse plans from a solution cache file (default file: " + DEFAULT_CACHE + ")")
+    args = parser.parse_args()
+    algorithm = Algorithm(args.algorithm)
+    if args.workers > 1 and algorithm in (Algorithm.IDA_STAR, Algorithm.SMA_STAR, Algorithm.ANYTIME):
+        parser.error("--workers runs astar, bfs, wastar or greedy in parallel, not " + algorithm.value)
+    if args.watch and algorithm != Algorithm.ASTAR:
+        parser.error("--watch replans with astar only")
+    if args.workers > 1 and args.watch:
+        parser.error("--watch replans in a single process, --workers does not apply")
+    if (args.memory_nodes is not None or args.memory_mb is not None) and algorithm != Algorithm.SMA_STAR:
+        parser.error("--memory-nodes and --memory-mb bound smastar only")
+    if (args.time_budget is not None or args.max_expansions is not None) and \
+            algorithm not in (Algorithm.ANYTIME, Algorithm.IDA_STAR):
+        parser.error("--time-budget and --max-expansions stop anytime and idastar only")
+
     game = Game()
-    if len(sys.argv) > 1:
-        path = sys.argv[1]
-        game.play(path)
+    if args.level is not None:
+        path = args.level
+        game.play(path, args.compiled)
+
+        cache = SolutionCache(args.cache) if args.cache is not None else None
+        memory_nodes = args.memory_nodes
+        if args.memory_mb is not None:
+            memory_nodes = int(args.memory_mb * 1024 * 1024) // SMA_NODE_BYTES
+        solver = Solver(algorithm, args.weight, args.workers, cache, profile=args.stats is not None,
+                        memory_nodes=memory_nodes, macros=not args.no_macros, time_budget=args.time_budget,
+                        max_expansions=args.max_expansions)
+        if args.watch:
+            try:
+                watch(path, solver)
+            except KeyboardInterrupt:
+                return
 
-        solver = Solver()
         start = time.time()
-        plan, expanded_states = solver.search(game)
+        result = solver.search(game)
         end = time.time()
-        if len(plan) > 0:
-            print("Number of expanded states: " + str(expanded_states))
+        if len(result.plan) > 0:
+            print("Number of expanded states: " + str(result.expanded))
+            print("Number of generated states: " + str(result.generated))
+            print("Number of pruned states: " + str(result.pruned))
+            if result.bound is not None:
+                print("Proven lower bound on the plan length: " + str(result.bound))
             print("Solving time: " + str(end - start) + " seconds")
             print("Plan for solving level " + path + ": ")
-            for ac in plan:
+            for ac in result.plan:
                 print("\t" + str(ac))
         else:
             print("Could not solve the level")
+            if result.bound is not None:
+                print("Proven lower bound on the plan length: " + str(result.bound))
+
+        if args.stats is not None:
+            report = {"level": path, "algorithm": args.algorithm, "plan_length": len(result.plan),
+                      "bound": result.bound}
+            report.update(solver.stats.as_dict())
+            if args.stats == "-":
+                print(json.dumps(report, indent=2))
+            else:
+                with open(args.stats, "w") as out:
+                    json.dump(report, out, indent=2)
 
     else:
         print("Error: Missing argument of path to json representation of level to solve")
-        # game.play("./levels/level1.json")
-    pass
 
 
 if __name__ == '__main__':
@@ -1,7 +1,9 @@
 import copy
 
-from model.Objects import Object, Item, ItemType
-from model.Tiles import DeadEndTile, Tile, MovingTile
+from model.Journal import set_attr, remove_item
+from model.Objects import Object, Item, ItemType, Lever
+from model.State import State, TRAP_INDEX, TRAP_POS
+from model.Tiles import DeadEndTile, Tile, MovingTile, TILE_MOVING
 from model.Trap import Trap
 from enum import Enum, IntEnum
 
@@ -15,14 +17,21 @@ class Action(IntEnum):
     USE_LEVER = 6
 
 
-def apply_traps_action(traps: list[Trap]):
+def apply_traps_action(traps: list[Trap], journal=None):
     for trap in copy.copy(traps):
         if trap.current_position is None:
-            traps.remove(trap)
+            remove_item(journal, traps, trap)
             continue
         if trap.guarded_tile is not None and not trap.guarded_tile.is_guarded:
-            trap.guarded_tile.is_guarded = True
-        trap.trap_action()
+            set_attr(journal, trap.guarded_tile, "is_guarded", True)
+        trap.trap_action(journal)
+
+
+def apply_traps_action_to_state(level, state):
+    for trap in state.traps:
+        if trap[TRAP_POS] is None:
+            continue
+        level.trap_strategies[trap[TRAP_INDEX]].execute_on_state(level, state, trap)
 
 
 class Agent(Object):
@@ -33,69 +42,121 @@ class Agent(Object):
     def carries_item(self):
         return self.item is not None
 
-    def set_position(self, tile):
+    def set_position(self, tile, journal=None):
         if tile.is_empty():
-            self.current_position = tile
-            tile.set_agent(self)
+            set_attr(journal, self, "current_position", tile)
+            tile.set_agent(self, journal)
 
-    def pickup_item(self, tile: Tile):
-        self.item = tile.item
-        self.item.pickup()
-        tile.remove_item()
+    def pickup_item(self, tile: Tile, journal=None):
+        set_attr(journal, self, "item", tile.item)
+        self.item.pickup(journal)
+        tile.remove_item(journal)
 
-    def move_to_position(self, tile: Tile, traps: list[Trap]):
-        self.current_position.remove_agent()
+    def move_to_position(self, tile: Tile, traps: list[Trap], journal=None):
+        self.current_position.remove_agent(journal)
 
         if tile.contains_trap() and tile.trap_on_tile.attack_able:
             trap = tile.trap_on_tile
-            traps.remove(trap)
-            trap.kill()
+            remove_item(journal, traps, trap)
+            trap.kill(journal)
         if tile.contains_item() and not self.carries_item():
-            self.pickup_item(tile)
+            self.pickup_item(tile, journal)
 
-        tile.agent_move_on(self)
+        tile.agent_move_on(self, journal)
 
-        apply_traps_action(traps)
+        apply_traps_action(traps, journal)
 
     @staticmethod
-    def use_lever(lever):
-        lever.use_lever()
+    def use_lever(lever, journal=None):
+        lever.use_lever(journal)
 
-    def use_item(self):
-        return self.item.use(self)
+    def use_item(self, journal=None):
+        return self.item.use(self, journal)
 
-    def apply_move_action(self, move_pos, traps: list[Trap]):
+    def apply_move_action(self, move_pos, traps: list[Trap], journal=None):
         if isinstance(move_pos, MovingTile):
             if move_pos.is_active:
-                self.move_to_position(move_pos, traps)
+                self.move_to_position(move_pos, traps, journal)
                 return True
             else:
                 return False
         else:
-            self.move_to_position(move_pos, traps)
+            self.move_to_position(move_pos, traps, journal)
             return True
 
-    def apply_action(self, action: Action, traps: list[Trap]):
+    def apply_action(self, action: Action, traps: list[Trap], journal=None):
         if not isinstance(self.current_position, DeadEndTile):
             if action == Action.MOVE_UP and self.current_position.up is not None:
-                return self.apply_move_action(self.current_position.up, traps)
+                return self.apply_move_action(self.current_position.up, traps, journal)
 
             elif action == Action.MOVE_DOWN and self.current_position.down is not None:
-                return self.apply_move_action(self.current_position.down, traps)
+                return self.apply_move_action(self.current_position.down, traps, journal)
 
             elif action == Action.MOVE_LEFT and self.current_position.left is not None:
-                return self.apply_move_action(self.current_position.left, traps)
+                return self.apply_move_action(self.current_position.left, traps, journal)
 
             elif action == Action.MOVE_RIGHT and self.current_position.right is not None:
-                return self.apply_move_action(self.current_position.right, traps)
+                return self.apply_move_action(self.current_position.right, traps, journal)
 
             elif action == Action.USE_LEVER and self.current_position.contains_lever():
-                self.use_lever(self.current_position.lever)
+                self.use_lever(self.current_position.lever, journal)
                 return True
             elif action == Action.USE_ITEM and self.carries_item():
-                return self.use_item()
+                return self.use_item(journal)
         return False
 
+    def state_key(self):
+        pos_id = None
+        if not isinstance(self.current_position, DeadEndTile):
+            pos_id = self.current_position.id
+
+        item_type = None
+        if self.carries_item():
+            item_type = self.item.type
+        return pos_id, item_type
+
+    @staticmethod
+    def move_to_state_position(level, state, tile_index):
+        trap = state.trap_on(tile_index)
+        if trap is not None and level.trap_attack_able[trap[TRAP_INDEX]]:
+            state.kill_trap(trap)
+        if tile_index in state.items and state.item is None:
+            state.item = level.item_types[tile_index]
+            state.items.remove(tile_index)
+
+        level.tile_class(tile_index).agent_move_on_state(level, state, tile_index)
+
+        apply_traps_action_to_state(level, state)
+
+    @staticmethod
+    def apply_action_to_state(level, state: State, action: Action):
+        """Compact counterpart of apply_action, returns the next State or None when the action is not applicable."""
+        pos = state.agent
+        if pos is None:
+            return None
+
+        if action in (Action.MOVE_UP, Action.MOVE_DOWN, Action.MOVE_LEFT, Action.MOVE_RIGHT):
+            move_pos = level.neighbor(pos, action)
+            if move_pos < 0:
+                return None
+            if level.types[move_pos] == TILE_MOVING and not level.is_active(state.active, move_pos):
+                return None
+
+            mutable = state.thaw()
+            Agent.move_to_state_position(level, mutable, move_pos)
+            return mutable.freeze()
+
+        elif action == Action.USE_LEVER and level.lever_masks[pos] is not None:
+            mutable = state.thaw()
+            Lever.use_lever_on_state(level.lever_masks[pos], mutable)
+            return mutable.freeze()
+
+        elif action == Action.USE_ITEM and state.item is not None:
+            mutable = state.thaw()
+            if Item.use_on_state(state.item, level, mutable):
+                return mutable.freeze()
+        return None
+
     def __str__(self):
         add_str = ""
         if self.carries_item():
@@ -1,10 +1,21 @@
 from typing import Dict, List
 
 from model.Agent import Agent, Action
-from model.Tiles import Tile, CrackedTile, MovingTile, AbstractTile
+from model.Journal import Journal
+from model.Level import Level, collect_tiles
+from model.Tiles import Tile, CrackedTile, MovingTile, MovingBits, AbstractTile
 from model.Objects import Lever, Item, ItemType
+from model.State import State
 from model.Trap import Trap, SawStrategy, TrapMovingDir, SnakeStrategy, SpiderStrategy, LizardStrategy
-import json, copy
+import json, copy, hashlib, os, pickle
+
+COMPILED_SUFFIX = ".compiled"
+COMPILED_VERSION = 8  # bump when the pickled Game or Level layout changes
+COMPILED_MAGIC = b"lcgo-compiled"
+COMPILED_CLASSES = (Agent, Action, Journal, Level, State, Tile, CrackedTile, MovingTile, MovingBits, Lever, Item,
+                    ItemType, Trap, TrapMovingDir, SnakeStrategy, SawStrategy, SpiderStrategy, LizardStrategy)
+UNPICKLE_GLOBALS = {(cls.__module__, cls.__qualname__) for cls in COMPILED_CLASSES} | \
+                   {("array", "array"), ("array", "_array_reconstructor")}
 
 
 def parse_json(path_file):
@@ -12,6 +23,22 @@ def parse_json(path_file):
     return json.loads(file.read())
 
 
+def file_signature(path):
+    with open(path, "rb") as file:
+        content = file.read()
+    return COMPILED_VERSION, os.stat(path).st_mtime_ns, hashlib.sha256(content).hexdigest()
+
+
+def compiled_header(path):
+    """Plain text first line of a compiled level, checked against its json before anything is unpickled."""
+    return b" ".join([COMPILED_MAGIC] + [str(part).encode() for part in file_signature(path)]) + b"\n"
+
+
+def level_content_hash(json_obj):
+    normalized = json.dumps(json_obj, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
 def create_tile(t_json):
     tile_type = t_json['type']
     t_id = t_json['id']
@@ -66,7 +93,7 @@ def create_tiles(tiles_json, agent):
 
 def set_tiles_coords(tiles, start_id):
     queue: List[(int, int, AbstractTile)] = [(0, 0, 0, start_id)]
-    visited = []
+    visited = set()
 
     while len(queue) > 0:
         x, y, z, curr_id = queue.pop()
@@ -76,7 +103,7 @@ def set_tiles_coords(tiles, start_id):
             continue
 
         curr.set_coords(x, y, z)
-        visited.append(curr.id)
+        visited.add(curr.id)
         if curr.left is not None and curr.left.id not in visited:
             queue.append((x - 1, y, z, curr.left.id))
         if curr.right is not None and curr.right.id not in visited:
@@ -89,40 +116,41 @@ def set_tiles_coords(tiles, start_id):
             queue.append((x, y, z - 1, curr.drop_on_tile.id))
 
 
+MOVING_DIRS = {direction.value: direction for direction in TrapMovingDir}
+
+
+def decode_moving_seq(moving_seq):
+    return [MOVING_DIRS[m] for m in moving_seq if m in MOVING_DIRS]
+
+
+def bind_moving_tiles(level: Level, tiles: Dict[int, AbstractTile]):
+    """Stores the activity of all MovingTiles in one bitmask laid out like Level.moving_bit, levers become XOR masks."""
+    bits = MovingBits()
+    collected = collect_tiles(tiles)
+    for t_id, tile in collected.items():
+        if isinstance(tile, MovingTile):
+            tile.bind_bits(bits, level.moving_bit[level.index[t_id]])
+    for tile in collected.values():
+        if tile.lever is not None:
+            tile.lever.compile_mask()
+    return bits
+
+
 def create_traps(traps_json, tiles: Dict[int, AbstractTile], agent):
     traps = []
     for trap_json in traps_json:
         trap = Trap(trap_json["can_attack"])
+        trap.index = len(traps)
         trap.set_position(tiles.get(trap_json["pos"]))
 
         if trap_json["type"] == "Snake":
             trap.set_trap(tiles.get(trap_json["guards"]), SnakeStrategy())
 
         elif trap_json["type"] == "Saw":
-            mov_seq = []
-            for m in trap_json["moving_seq"]:
-                if m == TrapMovingDir.UP.value:
-                    mov_seq.append(TrapMovingDir.UP)
-                elif m == TrapMovingDir.DOWN.value:
-                    mov_seq.append(TrapMovingDir.DOWN)
-                elif m == TrapMovingDir.LEFT.value:
-                    mov_seq.append(TrapMovingDir.LEFT)
-                elif m == TrapMovingDir.RIGHT.value:
-                    mov_seq.append(TrapMovingDir.RIGHT)
-            trap.set_trap(tiles.get(trap_json["guards"]), SawStrategy(mov_seq))
+            trap.set_trap(tiles.get(trap_json["guards"]), SawStrategy(decode_moving_seq(trap_json["moving_seq"])))
 
         elif trap_json["type"] == "Spider":
-            mov_seq = []
-            for m in trap_json["moving_seq"]:
-                if m == TrapMovingDir.UP.value:
-                    mov_seq.append(TrapMovingDir.UP)
-                elif m == TrapMovingDir.DOWN.value:
-                    mov_seq.append(TrapMovingDir.DOWN)
-                elif m == TrapMovingDir.LEFT.value:
-                    mov_seq.append(TrapMovingDir.LEFT)
-                elif m == TrapMovingDir.RIGHT.value:
-                    mov_seq.append(TrapMovingDir.RIGHT)
-            trap.set_trap(tiles.get(trap_json["guards"]), SpiderStrategy(mov_seq))
+            trap.set_trap(tiles.get(trap_json["guards"]), SpiderStrategy(decode_moving_seq(trap_json["moving_seq"])))
 
         elif trap_json["type"] == "Lizard":
             trap.set_trap(tiles.get(trap_json["guards"]), LizardStrategy(tiles.get(trap_json["activates"]), agent))
@@ -149,16 +177,51 @@ def create_levers(levers_json, tiles: Dict[int, AbstractTile]):
             lever.assign_tile(tiles.get(assigned_id))
 
 
+class TilePickler(pickle.Pickler):
+    """Pickles tile references as tile ids, so the depth of the pickled tile graph does not grow with its size."""
+
+    def __init__(self, file, tiles: Dict[int, AbstractTile]):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.tiles = tiles
+
+    def persistent_id(self, obj):
+        if isinstance(obj, AbstractTile) and self.tiles.get(obj.id) is obj:
+            return obj.id
+        return None
+
+
+class TileUnpickler(pickle.Unpickler):
+    """Resolves tile ids back to tiles and only loads the classes save_compiled writes (and arrays)."""
+
+    def __init__(self, file, tiles: Dict[int, AbstractTile]):
+        super().__init__(file)
+        self.tiles = tiles
+
+    def persistent_load(self, pid):
+        return self.tiles[pid]
+
+    def find_class(self, module, name):
+        if "." in name or (module, name) not in UNPICKLE_GLOBALS:
+            raise pickle.UnpicklingError("compiled level refers to " + module + "." + name)
+        return super().find_class(module, name)
+
+
 class Game:
     def __init__(self):
         self.goal = None
         self.agent = None
         self.traps = []
         self.tiles = None
+        self.level = None
+        self.content_hash = None
+
+        self.journal = Journal()
+        self.made_marks = []
 
     def load_game(self, path):
-        json_obj = parse_json(path)
+        self.load_json(parse_json(path))
 
+    def load_json(self, json_obj):
         tiles, self.goal = create_tiles(json_obj["tiles"], json_obj["agent"])
 
         agent = Agent()
@@ -170,14 +233,81 @@ class Game:
 
         self.agent = agent
         self.tiles = tiles
+        self.level = Level(self)
+        bind_moving_tiles(self.level, tiles)
+        self.content_hash = level_content_hash(json_obj)
+
+    def play(self, level_path, compiled=False):
+        """Loads a level, with compiled=True the loaded game is reused from a pickled artifact next to the json
+        while the json keeps the same modification time and content.
+
+        The artifact starts with a plain header holding the sha256 of the json, compared before anything is
+        unpickled, and unpickling is limited to model classes. Even so, a compiled file is trusted as much as code:
+        only use compiled=True in directories nobody else can write to."""
+        if compiled and self.load_compiled(level_path):
+            return
 
-    def play(self, level_path):
         self.load_game(level_path)
+        if compiled:
+            self.save_compiled(level_path)
+
+    def load_compiled(self, level_path):
+        try:
+            with open(level_path + COMPILED_SUFFIX, "rb") as file:
+                if file.readline(len(COMPILED_MAGIC) + 128) != compiled_header(level_path):
+                    return False
+
+                shells = TileUnpickler(file, {}).load()
+                registry = {t_id: tile_class.__new__(tile_class) for tile_class, t_id in shells}
+                tiles_state, game_state = TileUnpickler(file, registry).load()
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError, KeyError):
+            return False
+
+        for t_id, tile_state in tiles_state.items():
+            registry[t_id].__dict__.update(tile_state)
+        self.__dict__.update(game_state)
+        return True
+
+    def save_compiled(self, level_path):
+        path = level_path + COMPILED_SUFFIX
+        tiles = collect_tiles(self.tiles)
+        try:
+            with open(path + ".tmp", "wb") as file:
+                file.write(compiled_header(level_path))
+                pickle.dump([(type(tile), t_id) for t_id, tile in tiles.items()], file, pickle.HIGHEST_PROTOCOL)
+                TilePickler(file, tiles).dump(({t_id: tile.__dict__ for t_id, tile in tiles.items()}, self.__dict__))
+            os.replace(path + ".tmp", path)
+        except (OSError, RecursionError, pickle.PicklingError):
+            return False
+        return True
 
     def clone(self):
-        clone = copy.deepcopy(self)
+        clone = copy.deepcopy(self, {id(self.level): self.level})
         return clone
 
+    def compiled_level(self):
+        if self.level is None:
+            return Level(self)
+        return self.level
+
+    def make(self, action: Action):
+        """Applies action on this live game recording every change, a failed action leaves the game untouched."""
+        mark = self.journal.mark()
+        if self.agent.apply_action(action, self.traps, self.journal):
+            self.made_marks.append(mark)
+            return True
+
+        self.journal.undo(mark)
+        return False
+
+    def unmake(self):
+        self.journal.undo(self.made_marks.pop())
+
+    def state_key(self):
+        traps_key = tuple(trap.state_key() for trap in self.traps if trap.current_position is not None)
+        tiles_key = tuple(tile.state_key() for tile in self.tiles.values())
+        return self.agent.state_key(), traps_key, tiles_key
+
     def __eq__(self, other):
         if isinstance(other, Game):
             if self.agent != other.agent:
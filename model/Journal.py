@@ -0,0 +1,50 @@
+class Journal:
+    """Records every change made to the live object model so it can be undone exactly."""
+
+    def __init__(self):
+        self.entries = []
+
+    def set(self, obj, attr, value):
+        self.entries.append((obj, attr, getattr(obj, attr)))
+        setattr(obj, attr, value)
+
+    def remove(self, items: list, item):
+        index = items.index(item)
+        del items[index]
+        self.entries.append((items, index, item))
+
+    def pop(self, items: list):
+        item = items.pop()
+        self.entries.append((items, len(items), item))
+        return item
+
+    def mark(self):
+        return len(self.entries)
+
+    def undo(self, mark=0):
+        while len(self.entries) > mark:
+            target, key, value = self.entries.pop()
+            if isinstance(target, list):
+                target.insert(key, value)
+            else:
+                setattr(target, key, value)
+
+
+def set_attr(journal, obj, attr, value):
+    if journal is None:
+        setattr(obj, attr, value)
+    else:
+        journal.set(obj, attr, value)
+
+
+def remove_item(journal, items: list, item):
+    if journal is None:
+        items.remove(item)
+    else:
+        journal.remove(items, item)
+
+
+def pop_item(journal, items: list):
+    if journal is None:
+        return items.pop()
+    return journal.pop(items)
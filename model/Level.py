@@ -0,0 +1,407 @@
+from array import array
+from collections import deque
+from typing import Dict, List
+
+from model.Agent import Action
+from model.State import State, TRAP_INDEX, TRAP_POS, TRAP_GUARDED, TRAP_PHASE
+from model.Tiles import AbstractTile, CrackedTile, MovingTile, DeadEndTile, TILE_NORMAL, TILE_CRACKED, TILE_MOVING, \
+    TILE_CLASSES
+from model.Trap import SawStrategy, SpiderStrategy, LizardStrategy, TrapMovingDir
+
+NO_TILE = -1
+UNREACHABLE = -1
+
+
+def collect_tiles(tiles: Dict[int, AbstractTile]):
+    collected: Dict[int, AbstractTile] = {}
+    stack: List[AbstractTile] = list(reversed(tiles.values()))
+
+    while len(stack) > 0:
+        tile = stack.pop()
+        if tile is None or tile.id in collected:
+            continue
+
+        collected[tile.id] = tile
+        stack.extend((tile.left, tile.right, tile.up, tile.down))
+        stack.extend(tile.air_connection)
+        if isinstance(tile, CrackedTile):
+            stack.append(tile.drop_on_tile)
+        if tile.lever is not None:
+            stack.extend(tile.lever.activates)
+    return collected
+
+
+def tile_type_code(tile: AbstractTile):
+    if isinstance(tile, CrackedTile):
+        return TILE_CRACKED
+    elif isinstance(tile, MovingTile):
+        return TILE_MOVING
+    return TILE_NORMAL
+
+
+def goal_distances(level):
+    """Reverse BFS from the goal tiles over the relaxed tile graph.
+
+    Every MovingTile counts as active and a move onto a cracked tile may also end on the tiles it drops to,
+    so the distances never overestimate the number of moves left.
+    """
+    tiles_count = len(level.ids)
+    reverse = [[] for _ in range(tiles_count)]
+    for tile in range(tiles_count):
+        for path in (level.left, level.right, level.up, level.down):
+            target = path[tile]
+            dropped = set()
+            while target != NO_TILE and target not in dropped:
+                reverse[target].append(tile)
+                dropped.add(target)
+                target = level.drop[target]
+
+    distances = array('i', [UNREACHABLE] * tiles_count)
+    queue = deque()
+    for tile in range(tiles_count):
+        if level.goals[tile]:
+            distances[tile] = 0
+            queue.append(tile)
+
+    while len(queue) > 0:
+        tile = queue.popleft()
+        for prev in reverse[tile]:
+            if distances[prev] == UNREACHABLE:
+                distances[prev] = distances[tile] + 1
+                queue.append(prev)
+    return distances
+
+
+OPPOSITE_MOVES = {Action.MOVE_LEFT: Action.MOVE_RIGHT, Action.MOVE_RIGHT: Action.MOVE_LEFT,
+                  Action.MOVE_UP: Action.MOVE_DOWN, Action.MOVE_DOWN: Action.MOVE_UP}
+
+
+def corridor_macros(level):
+    """Moves into corridors, collapsed into the whole walk to the tile past the corridor's other end.
+
+    A corridor tile is a plain tile with exactly two neighbours that both lead back to it, holding no item, lever,
+    air connection, goal or trap and not guarded or watched by one in the initial state. No macro starts on a
+    cracked tile or a lizard's activating tile, stepping back onto those changes the state, so the single step into
+    the corridor stays available there. Returns, per tile, None or a dict from each move entering a corridor to the
+    tuple of moves walking through it.
+    """
+    tiles_count = len(level.types)
+    excluded = set(level.initial_state.items)
+    activating = set()
+    for trap in level.initial_state.traps:
+        excluded.update((trap[TRAP_POS], trap[TRAP_GUARDED]))
+        if isinstance(level.trap_strategies[trap[TRAP_INDEX]], LizardStrategy):
+            activating.add(trap[TRAP_PHASE][0])
+    excluded.update(activating)
+
+    def exits(tile):
+        return [(action, path[tile]) for action, path in level.paths.items() if path[tile] != NO_TILE]
+
+    corridor = [False] * tiles_count
+    for tile in range(tiles_count):
+        if level.types[tile] != TILE_NORMAL or level.goals[tile] or level.lever_masks[tile] is not None or \
+                level.air_slot[tile] != NO_TILE or tile in excluded:
+            continue
+        moves = exits(tile)
+        corridor[tile] = len(moves) == 2 and all(level.neighbor(n, OPPOSITE_MOVES[a]) == tile for a, n in moves)
+
+    macros = [None] * tiles_count
+    for tile in range(tiles_count):
+        if level.types[tile] == TILE_CRACKED or tile in activating:
+            continue
+        for action, entry in exits(tile):
+            if not corridor[entry]:
+                continue
+            walk = [action]
+            prev, curr = tile, entry
+            while corridor[curr] and len(walk) <= tiles_count:
+                action, curr, prev = next((a, n, curr) for a, n in exits(curr) if n != prev)
+                walk.append(action)
+            if macros[tile] is None:
+                macros[tile] = {}
+            macros[tile][walk[0]] = tuple(walk)
+    return macros
+
+
+class Level:
+    """Static topology of a loaded Game, compiled once and shared by every search state.
+
+    Tiles get dense indices, paths and drops are integer arrays holding NO_TILE where there is none.
+    MovingTile activity is a bitmask over moving tiles, levers compile to the mask of bits they flip.
+    After __init__ only the memo caches change, each by single dict operations, so threads may share a Level.
+    """
+
+    def __init__(self, game):
+        tiles = collect_tiles(game.tiles)
+
+        self.ids = array('i', tiles.keys())
+        self.index = {t_id: i for i, t_id in enumerate(self.ids)}
+        tiles_list = list(tiles.values())
+
+        def index_of(tile: AbstractTile):
+            if tile is None:
+                return NO_TILE
+            return self.index[tile.id]
+
+        self.types = array('b', (tile_type_code(tile) for tile in tiles_list))
+        self.left = array('i', (index_of(tile.left) for tile in tiles_list))
+        self.right = array('i', (index_of(tile.right) for tile in tiles_list))
+        self.up = array('i', (index_of(tile.up) for tile in tiles_list))
+        self.down = array('i', (index_of(tile.down) for tile in tiles_list))
+        self.drop = array('i', (index_of(tile.drop_on_tile) if isinstance(tile, CrackedTile) else NO_TILE
+                                for tile in tiles_list))
+        self.goals = array('b', (tile.is_goal for tile in tiles_list))
+        self.coords = [(tile.x, tile.y, tile.z) for tile in tiles_list]
+
+        self.paths = {Action.MOVE_LEFT: self.left, Action.MOVE_RIGHT: self.right,
+                      Action.MOVE_UP: self.up, Action.MOVE_DOWN: self.down}
+        self.trap_paths = {TrapMovingDir.LEFT: self.left, TrapMovingDir.RIGHT: self.right,
+                           TrapMovingDir.UP: self.up, TrapMovingDir.DOWN: self.down}
+
+        coords_tiles = {}
+        for i, coords in enumerate(self.coords):
+            coords_tiles.setdefault(coords, []).append(i)
+        offsets = {Action.MOVE_LEFT: (-1, 0), Action.MOVE_RIGHT: (1, 0), Action.MOVE_UP: (0, 1), Action.MOVE_DOWN: (0, -1)}
+        self.coord_neighbors = {}
+        for action, (dx, dy) in offsets.items():
+            self.coord_neighbors[action] = tuple(tuple(coords_tiles.get((x + dx, y + dy, z), ()))
+                                                 for x, y, z in self.coords)
+
+        self.moving_bit = array('i', [NO_TILE] * len(tiles_list))
+        moving_count = 0
+        for i, tile_type in enumerate(self.types):
+            if tile_type == TILE_MOVING:
+                self.moving_bit[i] = moving_count
+                moving_count += 1
+
+        self.lever_masks = [None] * len(tiles_list)
+        self.lever_controlled = 0
+        self.air_slot = array('i', [NO_TILE] * len(tiles_list))
+        self.air_targets = []
+        self.item_types = [None] * len(tiles_list)
+        for i, tile in enumerate(tiles_list):
+            if tile.lever is not None:
+                mask = 0
+                for moving_tile in tile.lever.activates:
+                    mask ^= 1 << self.moving_bit[self.index[moving_tile.id]]
+                self.lever_masks[i] = mask
+                self.lever_controlled |= mask
+            if tile.contains_air_connection():
+                self.air_slot[i] = len(self.air_targets)
+                self.air_targets.append(array('i', (index_of(t) for t in tile.air_connection)))
+            if tile.contains_item():
+                self.item_types[i] = tile.item.type
+        self.has_items = any(item_type is not None for item_type in self.item_types)
+
+        self.goal = index_of(game.goal)
+        self.goal_distance = goal_distances(self)
+        for i, trap in enumerate(game.traps):
+            if trap.index is None:  # traps built by hand rather than by create_traps
+                trap.index = i
+        self.trap_strategies = tuple(trap.trap_strategy for trap in game.traps)
+        self.trap_attack_able = tuple(trap.attack_able for trap in game.traps)
+        self.trap_is_saw = tuple(isinstance(trap.trap_strategy, SawStrategy) for trap in game.traps)
+        self.trap_configs = [{} if isinstance(strategy, (SawStrategy, SpiderStrategy)) else None
+                             for strategy in self.trap_strategies]
+        self.trap_transitions = [[] for _ in self.trap_strategies]
+        for trap in game.traps:
+            if trap.current_position is not None and self.trap_configs[trap.index] is not None:
+                self.trap_config(trap.index, self.index[trap.current_position.id], self.index[trap.guarded_tile.id],
+                                 trap.trap_strategy.curr)
+
+        self.initial_state = self.state_of(game)
+        self.never_active = ~self.initial_state.active & ~self.lever_controlled
+        self.goal_reachable_cache = {}
+        self.forbidden_cache = {}
+        self.trap_is_periodic = tuple(config is not None for config in self.trap_configs)
+        self.macros = corridor_macros(self)
+
+    def state_of(self, game) -> State:
+        agent_pos = None
+        if not isinstance(game.agent.current_position, DeadEndTile):
+            agent_pos = self.index[game.agent.current_position.id]
+
+        item = None
+        if game.agent.carries_item():
+            item = game.agent.item.type
+
+        traps = []
+        for trap in game.traps:
+            if trap.current_position is None:
+                continue
+            i = trap.index
+
+            strategy = trap.trap_strategy
+            phase = None
+            guarded = None
+            if trap.guarded_tile is not None:
+                guarded = self.index[trap.guarded_tile.id]
+            pos = self.index[trap.current_position.id]
+
+            if isinstance(strategy, LizardStrategy):
+                phase = (self.index[strategy.next_tile.id], strategy.is_active)
+            elif self.trap_configs[i] is not None:
+                phase = self.trap_configs[i][(pos, guarded, strategy.curr)]
+            traps.append((i, pos, guarded, phase))
+
+        items, cracked, destroyed = set(), set(), set()
+        active = 0
+        air = [0] * len(self.air_targets)
+        for t_id, tile in collect_tiles(game.tiles).items():
+            i = self.index[t_id]
+            if tile.contains_item():
+                items.add(i)
+            if isinstance(tile, CrackedTile):
+                if tile.is_cracked:
+                    cracked.add(i)
+                if tile.is_destroyed:
+                    destroyed.add(i)
+            if isinstance(tile, MovingTile) and tile.is_active:
+                active |= 1 << self.moving_bit[i]
+            if self.air_slot[i] != NO_TILE:
+                air[self.air_slot[i]] = len(tile.air_connection)
+
+        return State(agent_pos, item, frozenset(items), tuple(traps), frozenset(cracked), frozenset(destroyed),
+                     active, tuple(air))
+
+    def trap_config(self, trap, pos, guarded, curr):
+        """Id of a saw or spider configuration (position, guarded tile, index in its moving sequence).
+
+        Compiles the chain of configurations the trap walks through from there into trap_transitions, where each
+        id maps to (mask of moving tiles that must be active for the step, (next id, next position, next guarded))
+        or to (0, None) when the next guarded tile does not exist. __init__ compiles the chain of every saw and
+        spider from where the game starts, which holds every configuration a game or search can reach.
+        """
+        configs = self.trap_configs[trap]
+        key = (pos, guarded, curr)
+        if key in configs:
+            return configs[key]
+
+        transitions = self.trap_transitions[trap]
+        moving_seq = self.trap_strategies[trap].guarded_tile_moving_seq
+        chain = []
+        while key not in configs:
+            configs[key] = len(transitions)
+            transitions.append((0, None))
+            chain.append(key)
+            pos, guarded, curr = key
+            next_guarded = self.trap_neighbor(guarded, moving_seq[curr])
+            if next_guarded == NO_TILE:
+                break
+            key = (guarded, next_guarded, (curr + 1) % len(moving_seq))
+
+        for pos, guarded, curr in chain:
+            next_guarded = self.trap_neighbor(guarded, moving_seq[curr])
+            if next_guarded == NO_TILE:
+                continue
+
+            need = 0
+            for tile in (pos, next_guarded):
+                if self.types[tile] == TILE_MOVING:
+                    need |= 1 << self.moving_bit[tile]
+            next_key = (guarded, next_guarded, (curr + 1) % len(moving_seq))
+            transitions[configs[(pos, guarded, curr)]] = (need, (configs[next_key], guarded, next_guarded))
+        return configs[chain[0]]
+
+    def landing_tiles(self, tile, cracked, destroyed, dropped=()):
+        """Tiles the agent may end on when moving onto tile, with the given cracked and destroyed tiles."""
+        if tile in destroyed or tile in dropped:
+            return []
+
+        tile_type = self.types[tile]
+        if tile_type == TILE_MOVING:
+            if self.never_active >> self.moving_bit[tile] & 1:
+                return []
+            return [tile]
+        elif tile_type == TILE_CRACKED:
+            drop = self.drop[tile]
+            landing = []
+            if tile not in cracked:
+                landing.append(tile)
+            if drop != NO_TILE:
+                landing.extend(self.landing_tiles(drop, cracked, destroyed, dropped + (tile,)))
+            return landing
+        return [tile]
+
+    def goal_reachable(self, cracked, destroyed):
+        """Tiles from which a goal tile may still be reached, traps and lever order are relaxed away."""
+        key = (cracked, destroyed)
+        reachable = self.goal_reachable_cache.get(key)
+        if reachable is not None:
+            return reachable
+
+        tiles_count = len(self.ids)
+        reverse = [[] for _ in range(tiles_count)]
+        for tile in range(tiles_count):
+            for path in (self.left, self.right, self.up, self.down):
+                if path[tile] != NO_TILE:
+                    for landing in self.landing_tiles(path[tile], cracked, destroyed):
+                        reverse[landing].append(tile)
+
+        reachable = bytearray(tiles_count)
+        queue = deque()
+        for tile in range(tiles_count):
+            if self.goals[tile]:
+                reachable[tile] = 1
+                queue.append(tile)
+
+        while len(queue) > 0:
+            tile = queue.popleft()
+            for prev in reverse[tile]:
+                if not reachable[prev]:
+                    reachable[prev] = 1
+                    queue.append(prev)
+
+        if len(self.goal_reachable_cache) >= 4096:
+            self.goal_reachable_cache.clear()
+        self.goal_reachable_cache[key] = reachable
+        return reachable
+
+    def forbidden_tiles(self, state: State):
+        """Tiles the agent should not step towards: cracked tiles without a drop, saws and tiles guarded by
+        attack-able traps. Cached by the cracked tiles and traps, the only parts of a state it depends on."""
+        key = (state.cracked, state.traps)
+        forbidden = self.forbidden_cache.get(key)
+        if forbidden is not None:
+            return forbidden
+
+        forbidden = {tile for tile in state.cracked if self.drop[tile] == NO_TILE}
+        for trap in state.traps:
+            if self.trap_is_saw[trap[TRAP_INDEX]]:
+                forbidden.add(trap[TRAP_POS])
+            elif self.trap_attack_able[trap[TRAP_INDEX]] and trap[TRAP_GUARDED] is not None:
+                forbidden.add(trap[TRAP_GUARDED])
+        forbidden = frozenset(forbidden)
+
+        if len(self.forbidden_cache) >= 4096:
+            self.forbidden_cache.clear()
+        self.forbidden_cache[key] = forbidden
+        return forbidden
+
+    def allows_macros(self, state: State):
+        """Corridor macros are exact only while nothing but the agent changes: no saw or spider is left and no
+        lizard follows the agent. Otherwise waiting inside a corridor may pay off."""
+        for trap in state.traps:
+            index = trap[TRAP_INDEX]
+            if self.trap_is_periodic[index] or \
+                    isinstance(self.trap_strategies[index], LizardStrategy) and trap[TRAP_PHASE][1]:
+                return False
+        return True
+
+    def is_hopeless(self, state: State):
+        return state.agent is None or not self.goal_reachable(state.cracked, state.destroyed)[state.agent]
+
+    def neighbor(self, i, action: Action):
+        return self.paths[action][i]
+
+    def trap_neighbor(self, i, dir: TrapMovingDir):
+        return self.trap_paths[dir][i]
+
+    def is_active(self, active, i):
+        return active >> self.moving_bit[i] & 1
+
+    def is_goal(self, state: State):
+        return state.agent is not None and self.goals[state.agent]
+
+    def tile_class(self, i):
+        return TILE_CLASSES[self.types[i]]
@@ -1,4 +1,6 @@
 from enum import Enum, IntEnum
+from model.Journal import set_attr
+from model.State import TRAP_INDEX
 from model.Tiles import AbstractTile, Tile, MovingTile
 
 
@@ -21,6 +23,8 @@ class Lever(Object):
     def __init__(self):
         super().__init__()
         self.activates = set()
+        self.bits = None
+        self.mask = 0
 
     def set_position(self, tile: AbstractTile):
         self.current_position = tile
@@ -28,10 +32,31 @@ class Lever(Object):
 
     def assign_tile(self, tile: MovingTile):
         self.activates.add(tile)
+        self.compile_mask()
+
+    def compile_mask(self):
+        """Compiles the assigned tiles to one XOR mask when they all share the same MovingBits."""
+        shared = {id(tile.bits) for tile in self.activates}
+        if len(shared) == 1:
+            self.bits = next(iter(self.activates)).bits
+            self.mask = 0
+            for tile in self.activates:
+                self.mask ^= 1 << tile.bit
+        else:
+            self.bits = None
+            self.mask = 0
+
+    def use_lever(self, journal=None):
+        if self.bits is not None:
+            set_attr(journal, self.bits, "mask", self.bits.mask ^ self.mask)
+            return
 
-    def use_lever(self):
         for tile in self.activates:
-            tile.flip_is_active()
+            tile.flip_is_active(journal)
+
+    @staticmethod
+    def use_lever_on_state(mask, state):
+        state.active ^= mask
 
     def __eq__(self, other):
         if super.__eq__(self, other) and isinstance(other, Lever):
@@ -64,26 +89,45 @@ class Item(Object):
         self.current_position = tile
         tile.set_item(self)
 
-    def pickup(self):
-        self.is_carried = True
-        self.current_position = None
+    def pickup(self, journal=None):
+        set_attr(journal, self, "is_carried", True)
+        set_attr(journal, self, "current_position", None)
 
-    def use(self, agent):
+    def use(self, agent, journal=None):
         if self.type == ItemType.SPEAR:
-            return self.use_spear(agent)
+            return self.use_spear(agent, journal)
 
     @staticmethod
-    def use_spear(agent):
+    def use_on_state(item_type, level, state):
+        if item_type == ItemType.SPEAR:
+            return Item.use_spear_on_state(level, state)
+        return False
+
+    @staticmethod
+    def use_spear(agent, journal=None):
         pos = agent.current_position
         if pos.contains_air_connection():
-            enemy_tile: AbstractTile = pos.pop_air_connection()
+            enemy_tile: AbstractTile = pos.pop_air_connection(journal)
             if enemy_tile.contains_trap():
                 trap = enemy_tile.trap_on_tile
-                if trap.kill():
-                    agent.item = None
+                if trap.kill(journal):
+                    set_attr(journal, agent, "item", None)
                     return True
         return False
 
+    @staticmethod
+    def use_spear_on_state(level, state):
+        air_slot = level.air_slot[state.agent]
+        if air_slot >= 0 and state.air[air_slot] != 0:
+            state.air[air_slot] -= 1
+            enemy_tile = level.air_targets[air_slot][state.air[air_slot]]
+            trap = state.trap_on(enemy_tile)
+            if trap is not None and level.trap_attack_able[trap[TRAP_INDEX]]:
+                state.kill_trap(trap)
+                state.item = None
+                return True
+        return False
+
     def __eq__(self, other):
         if isinstance(other, Item):
             return super.__eq__(self, other) and (self.type, self.is_carried) == (other.type, other.is_carried)
@@ -0,0 +1,61 @@
+import hashlib
+from typing import NamedTuple, Optional, FrozenSet, Tuple
+
+TRAP_INDEX, TRAP_POS, TRAP_GUARDED, TRAP_PHASE = 0, 1, 2, 3
+
+
+class State(NamedTuple):
+    """Compact, immutable snapshot of everything that changes while playing a level.
+
+    Static data (paths, coordinates, drops, levers, trap sequences) lives in model.Level.Level.
+    Tiles are referenced by their level index, agent is None when it is in a dead-end.
+    Each trap is stored as (trap index in level, position, guarded tile, strategy phase).
+    MovingTile activity is a bitmask indexed by Level.moving_bit.
+    """
+    agent: Optional[int]
+    item: Optional[int]
+    items: FrozenSet[int]
+    traps: Tuple[Tuple, ...]
+    cracked: FrozenSet[int]
+    destroyed: FrozenSet[int]
+    active: int
+    air: Tuple[int, ...]
+
+    def thaw(self):
+        return MutableState(self)
+
+    def digest(self) -> str:
+        """Hash of the snapshot that stays the same across processes, sets are sorted first."""
+        canonical = (self.agent, self.item, sorted(self.items), self.traps, sorted(self.cracked),
+                     sorted(self.destroyed), self.active, self.air)
+        return hashlib.sha256(repr(canonical).encode()).hexdigest()[:16]
+
+
+class MutableState:
+    """Scratch copy of a State used while a single action is applied."""
+
+    def __init__(self, state: State):
+        self.agent = state.agent
+        self.item = state.item
+        self.items = set(state.items)
+        self.traps = [list(trap) for trap in state.traps]
+        self.cracked = set(state.cracked)
+        self.destroyed = set(state.destroyed)
+        self.active = state.active
+        self.air = list(state.air)
+
+    def trap_on(self, tile_id):
+        """Of the traps sharing the tile the one loaded last, like AbstractTile.trap_on_tile."""
+        for trap in reversed(self.traps):
+            if trap[TRAP_POS] == tile_id:
+                return trap
+        return None
+
+    def kill_trap(self, trap):
+        trap[TRAP_POS] = None
+        trap[TRAP_GUARDED] = None
+
+    def freeze(self):
+        traps = tuple(tuple(trap) for trap in self.traps if trap[TRAP_POS] is not None)
+        return State(self.agent, self.item, frozenset(self.items), traps, frozenset(self.cracked),
+                     frozenset(self.destroyed), self.active, tuple(self.air))
@@ -1,3 +1,6 @@
+from model.Journal import set_attr, pop_item
+
+
 class AbstractTile:
     def __init__(self, type_name, id_num):
         self.type: str = type_name
@@ -11,7 +14,7 @@ class AbstractTile:
         self.item = None
         self.lever = None
         self.agent = None
-        self.trap_on_tile = None
+        self.traps_on_tile = ()
 
         self.air_connection = []
         self.is_goal = False
@@ -22,8 +25,17 @@ class AbstractTile:
         self.y = y
         self.z = z
 
-    def set_trap(self, trap):
-        self.trap_on_tile = trap
+    @property
+    def trap_on_tile(self):
+        """Of the traps sharing the tile the one loaded last, MutableState.trap_on picks the same."""
+        return self.traps_on_tile[-1] if len(self.traps_on_tile) != 0 else None
+
+    def set_trap(self, trap, journal=None):
+        traps = sorted(self.traps_on_tile + (trap,), key=lambda t: -1 if t.index is None else t.index)
+        set_attr(journal, self, "traps_on_tile", tuple(traps))
+
+    def remove_trap(self, trap, journal=None):
+        set_attr(journal, self, "traps_on_tile", tuple(t for t in self.traps_on_tile if t is not trap))
 
     def set_path(self, left, right, up, down):
         self.left: Tile = left
@@ -43,8 +55,8 @@ class AbstractTile:
     def pop_air_connection_index(self, index):
         return self.air_connection.pop(index)
 
-    def pop_air_connection(self):
-        return self.air_connection.pop()
+    def pop_air_connection(self, journal=None):
+        return pop_item(journal, self.air_connection)
 
     def contains_air_connection(self):
         return len(self.air_connection) != 0
@@ -58,12 +70,12 @@ class AbstractTile:
     def contains_trap(self):
         return self.trap_on_tile is not None
 
-    def remove_item(self):
-        self.item.current_position = None
-        self.item = None
+    def remove_item(self, journal=None):
+        set_attr(journal, self.item, "current_position", None)
+        set_attr(journal, self, "item", None)
 
-    def remove_agent(self):
-        self.agent = None
+    def remove_agent(self, journal=None):
+        set_attr(journal, self, "agent", None)
 
     def is_empty(self):
         return self.agent is None
@@ -74,16 +86,23 @@ class AbstractTile:
     def set_item(self, item):
         self.item = item
 
-    def set_agent(self, agent):
+    def set_agent(self, agent, journal=None):
         if self.is_empty():
-            self.agent = agent
+            set_attr(journal, self, "agent", agent)
 
     def can_move_on(self):
         pass
 
-    def agent_move_on(self, agent):
+    def agent_move_on(self, agent, journal=None):
         pass
 
+    @staticmethod
+    def agent_move_on_state(level, state, tile_index):
+        pass
+
+    def state_key(self):
+        return len(self.air_connection), self.item is not None
+
     def __eq__(self, other):
         if isinstance(other, AbstractTile):
             self_info = (self.type, self.id, self.x, self.y, self.z, self.item, self.lever, self.trap_on_tile, self.is_goal, self.is_guarded)
@@ -102,8 +121,12 @@ class DeadEndTile(AbstractTile):
     def __init__(self):
         super().__init__("DEAD-END", 0)
 
-    def agent_move_on(self, agent):
-        agent.set_position(self)
+    def agent_move_on(self, agent, journal=None):
+        agent.set_position(self, journal)
+
+    @staticmethod
+    def agent_move_on_state(level, state, tile_index=None):
+        state.agent = None
 
     def can_move_on(self):
         return True
@@ -116,8 +139,12 @@ class Tile(AbstractTile):
     def __init__(self, num):
         super().__init__("NORMAL", num)
 
-    def agent_move_on(self, agent):
-        agent.set_position(self)
+    def agent_move_on(self, agent, journal=None):
+        agent.set_position(self, journal)
+
+    @staticmethod
+    def agent_move_on_state(level, state, tile_index):
+        state.agent = tile_index
 
     def can_move_on(self):
         return True
@@ -141,33 +168,56 @@ class CrackedTile(AbstractTile):
     def set_drop_on_tile(self, tile: AbstractTile):
         self.drop_on_tile: AbstractTile = tile
 
-    def agent_move_on(self, agent):
+    def agent_move_on(self, agent, journal=None):
         if not self.is_destroyed:
             if self.is_cracked:
                 if self.drop_on_tile is not None:
                     if isinstance(self.drop_on_tile, MovingTile):
                         if self.drop_on_tile.is_active:
-                            self.drop_on_tile.agent_move_on(agent)
+                            self.drop_on_tile.agent_move_on(agent, journal)
                         else:
                             dead_end = DeadEndTile()
-                            dead_end.agent_move_on(agent)
+                            dead_end.agent_move_on(agent, journal)
                     else:
-                        self.drop_on_tile.agent_move_on(agent)
+                        self.drop_on_tile.agent_move_on(agent, journal)
                 else:
                     dead_end = DeadEndTile()
-                    dead_end.agent_move_on(agent)
+                    dead_end.agent_move_on(agent, journal)
 
-                self.is_destroyed = True
+                set_attr(journal, self, "is_destroyed", True)
             else:
-                agent.set_position(self)
-                self.is_cracked = True
+                agent.set_position(self, journal)
+                set_attr(journal, self, "is_cracked", True)
         else:
             dead_end = DeadEndTile()
-            dead_end.agent_move_on(agent)
+            dead_end.agent_move_on(agent, journal)
+
+    @staticmethod
+    def agent_move_on_state(level, state, tile_index):
+        if tile_index not in state.destroyed:
+            if tile_index in state.cracked:
+                drop_index = level.drop[tile_index]
+                if drop_index >= 0:
+                    if level.types[drop_index] == TILE_MOVING and not level.is_active(state.active, drop_index):
+                        DeadEndTile.agent_move_on_state(level, state)
+                    else:
+                        level.tile_class(drop_index).agent_move_on_state(level, state, drop_index)
+                else:
+                    DeadEndTile.agent_move_on_state(level, state)
+
+                state.destroyed.add(tile_index)
+            else:
+                state.agent = tile_index
+                state.cracked.add(tile_index)
+        else:
+            DeadEndTile.agent_move_on_state(level, state)
 
     def is_cracked_without_drop_tile(self):
         return self.is_cracked and self.drop_on_tile is None
 
+    def state_key(self):
+        return super().state_key() + (self.is_cracked, self.is_destroyed)
+
     def can_move_on(self):
         return True
 
@@ -197,21 +247,56 @@ class CrackedTile(AbstractTile):
         return super.__hash__(self)
 
 
+class MovingBits:
+    """Activity of the MovingTiles of one game as a single bitmask, shared by the tiles and compiled levers."""
+
+    def __init__(self, mask: int = 0):
+        self.mask = mask
+
+
 class MovingTile(AbstractTile):
     def __init__(self, num, is_active: bool):
         super().__init__("MOVING", num)
-        self.is_active: bool = is_active
+        self.bits = MovingBits()
+        self.bit = 0
+        self.is_active = is_active
+
+    @property
+    def is_active(self) -> bool:
+        return self.bits.mask >> self.bit & 1 == 1
+
+    @is_active.setter
+    def is_active(self, is_active: bool):
+        if is_active:
+            self.bits.mask |= 1 << self.bit
+        else:
+            self.bits.mask &= ~(1 << self.bit)
+
+    def bind_bits(self, bits: MovingBits, bit: int):
+        """Moves this tile's activity into bit of a bitmask shared with the other MovingTiles of the game."""
+        is_active = self.is_active
+        self.bits = bits
+        self.bit = bit
+        self.is_active = is_active
 
-    def flip_is_active(self):
-        self.is_active = not self.is_active
+    def flip_is_active(self, journal=None):
+        set_attr(journal, self.bits, "mask", self.bits.mask ^ 1 << self.bit)
 
-    def agent_move_on(self, agent):
+    def agent_move_on(self, agent, journal=None):
         if self.is_active:
-            agent.set_position(self)
+            agent.set_position(self, journal)
+
+    @staticmethod
+    def agent_move_on_state(level, state, tile_index):
+        if level.is_active(state.active, tile_index):
+            state.agent = tile_index
 
     def can_move_on(self):
         return self.is_active
 
+    def state_key(self):
+        return super().state_key() + (self.is_active,)
+
     def __str__(self):
         super_str = super().__str__()
         add_str = ", is active: " + str(self.is_active)
@@ -225,3 +310,7 @@ class MovingTile(AbstractTile):
 
     def __hash__(self):
         return super.__hash__(self)
+
+
+TILE_NORMAL, TILE_CRACKED, TILE_MOVING = 0, 1, 2
+TILE_CLASSES = (Tile, CrackedTile, MovingTile)
@@ -1,5 +1,7 @@
+from model.Journal import set_attr
 from model.Objects import Object
-from model.Tiles import AbstractTile, DeadEndTile, MovingTile, CrackedTile
+from model.State import TRAP_INDEX, TRAP_POS, TRAP_GUARDED, TRAP_PHASE
+from model.Tiles import AbstractTile, DeadEndTile, MovingTile, CrackedTile, TILE_CRACKED
 from enum import Enum
 
 
@@ -11,9 +13,15 @@ class TrapMovingDir(Enum):
 
 
 class TrapStrategy:
-    def execute(self, trap):
+    def execute(self, trap, journal=None):
         pass
 
+    def execute_on_state(self, level, state, trap):
+        pass
+
+    def state_key(self):
+        return None
+
 
 class Trap(Object):
     def __init__(self, attack_able: bool):
@@ -21,10 +29,11 @@ class Trap(Object):
         self.guarded_tile: AbstractTile = None
         self.trap_strategy: TrapStrategy = None
         self.attack_able: bool = attack_able
+        self.index: int = None
 
-    def set_position(self, tile: AbstractTile):
-        self.current_position = tile
-        tile.set_trap(self)
+    def set_position(self, tile: AbstractTile, journal=None):
+        set_attr(journal, self, "current_position", tile)
+        tile.set_trap(self, journal)
 
     def set_trap(self, tile: AbstractTile, trap_strategy: TrapStrategy):
         if tile is not None:
@@ -32,16 +41,22 @@ class Trap(Object):
             self.guarded_tile.is_guarded = True
         self.trap_strategy = trap_strategy
 
-    def trap_action(self):
-        self.trap_strategy.execute(self)
+    def trap_action(self, journal=None):
+        self.trap_strategy.execute(self, journal)
 
-    def kill(self):
+    def state_key(self):
+        guarded_id = None
+        if self.guarded_tile is not None:
+            guarded_id = self.guarded_tile.id
+        return self.current_position.id, guarded_id, self.trap_strategy.state_key()
+
+    def kill(self, journal=None):
         if self.attack_able:
             if self.guarded_tile is not None:
-                self.guarded_tile.is_guarded = False
-            self.current_position.trap_on_tile = None
-            self.current_position = None
-            self.guarded_tile = None
+                set_attr(journal, self.guarded_tile, "is_guarded", False)
+            self.current_position.remove_trap(self, journal)
+            set_attr(journal, self, "current_position", None)
+            set_attr(journal, self, "guarded_tile", None)
             return True
         else:
             return False
@@ -80,10 +95,10 @@ def can_trap_move(dir: TrapMovingDir, trap: Trap):
         return True
 
 
-def trap_move(dir: TrapMovingDir, trap: Trap):
-    trap.current_position.trap_on_tile = None
-    trap.guarded_tile.is_guarded = False
-    trap.set_position(trap.guarded_tile)
+def trap_move(dir: TrapMovingDir, trap: Trap, journal=None):
+    trap.current_position.remove_trap(trap, journal)
+    set_attr(journal, trap.guarded_tile, "is_guarded", False)
+    trap.set_position(trap.guarded_tile, journal)
 
     next_guarded_tile = None
     if dir == TrapMovingDir.DOWN:
@@ -95,20 +110,44 @@ def trap_move(dir: TrapMovingDir, trap: Trap):
     elif dir == TrapMovingDir.RIGHT:
         next_guarded_tile = trap.guarded_tile.right
 
-    next_guarded_tile.is_guarded = True
-    trap.guarded_tile = next_guarded_tile
+    set_attr(journal, next_guarded_tile, "is_guarded", True)
+    set_attr(journal, trap, "guarded_tile", next_guarded_tile)
+
+
+def periodic_move_on_state(level, state, trap):
+    """Saw and spider step: one lookup in the trap's transition table, see Level.trap_config."""
+    need, moved = level.trap_transitions[trap[TRAP_INDEX]][trap[TRAP_PHASE]]
+    if moved is not None and state.active & need == need:
+        trap[TRAP_PHASE], trap[TRAP_POS], trap[TRAP_GUARDED] = moved
+
+
+def crack_tile_on_state(level, state, trap):
+    """Spider and lizard crack the tile they stand on, destroyed tile takes the trap with it."""
+    pos = trap[TRAP_POS]
+    if level.types[pos] == TILE_CRACKED:
+        if pos not in state.cracked:
+            state.cracked.add(pos)
+        elif level.drop[pos] < 0:
+            state.destroyed.add(pos)
+            state.kill_trap(trap)
+            return True
+    return False
 
 
 class SnakeStrategy(TrapStrategy):
     def __init__(self):
         return
 
-    def execute(self, trap):
+    def execute(self, trap, journal=None):
         if trap.guarded_tile is not None and trap.guarded_tile.agent is not None:
             dead_end = DeadEndTile()
-            dead_end.agent_move_on(trap.guarded_tile.agent)
+            dead_end.agent_move_on(trap.guarded_tile.agent, journal)
         return
 
+    def execute_on_state(self, level, state, trap):
+        if trap[TRAP_GUARDED] is not None and state.agent == trap[TRAP_GUARDED]:
+            DeadEndTile.agent_move_on_state(level, state)
+
     def __eq__(self, other):
         if isinstance(other, SnakeStrategy):
             return True
@@ -121,23 +160,36 @@ class SawStrategy(TrapStrategy):
         self.curr = 0
         return
 
-    def execute(self, trap):
+    def execute(self, trap, journal=None):
 
         if can_trap_move(self.guarded_tile_moving_seq[self.curr], trap):
-            trap_move(self.guarded_tile_moving_seq[self.curr], trap)
-            self.curr += 1
+            trap_move(self.guarded_tile_moving_seq[self.curr], trap, journal)
+            set_attr(journal, self, "curr", self.curr + 1)
 
             if self.curr == len(self.guarded_tile_moving_seq):
-                self.curr = 0
+                set_attr(journal, self, "curr", 0)
 
         if trap.current_position.agent is not None:
             agent = trap.current_position.agent
             dead_end = DeadEndTile()
-            dead_end.agent_move_on(agent)
+            dead_end.agent_move_on(agent, journal)
 
         other_trap: Trap = trap.guarded_tile.trap_on_tile
         if other_trap is not None and other_trap.attack_able:
-            other_trap.kill()
+            other_trap.kill(journal)
+
+    def execute_on_state(self, level, state, trap):
+        periodic_move_on_state(level, state, trap)
+
+        if state.agent == trap[TRAP_POS]:
+            DeadEndTile.agent_move_on_state(level, state)
+
+        other_trap = state.trap_on(trap[TRAP_GUARDED])
+        if other_trap is not None and level.trap_attack_able[other_trap[TRAP_INDEX]]:
+            state.kill_trap(other_trap)
+
+    def state_key(self):
+        return self.curr
 
     def __str__(self):
         return "current number: " + str(self.curr)
@@ -154,27 +206,40 @@ class SpiderStrategy(TrapStrategy):
         self.curr = 0
         return
 
-    def execute(self, trap):
+    def execute(self, trap, journal=None):
         if can_trap_move(self.guarded_tile_moving_seq[self.curr], trap):
-            trap_move(self.guarded_tile_moving_seq[self.curr], trap)
-            self.curr += 1
+            trap_move(self.guarded_tile_moving_seq[self.curr], trap, journal)
+            set_attr(journal, self, "curr", self.curr + 1)
 
             if self.curr == len(self.guarded_tile_moving_seq):
-                self.curr = 0
+                set_attr(journal, self, "curr", 0)
         if isinstance(trap.current_position, CrackedTile):
             if not trap.current_position.is_cracked:
-                trap.current_position.is_cracked = True
+                set_attr(journal, trap.current_position, "is_cracked", True)
             elif trap.current_position.is_cracked_without_drop_tile():
-                trap.current_position.is_destroyed = True
-                trap.guarded_tile.is_guarded = False
-                trap.guarded_tile = None
-                trap.current_position = None
+                set_attr(journal, trap.current_position, "is_destroyed", True)
+                trap.current_position.remove_trap(trap, journal)
+                set_attr(journal, trap.guarded_tile, "is_guarded", False)
+                set_attr(journal, trap, "guarded_tile", None)
+                set_attr(journal, trap, "current_position", None)
                 return
 
         if trap.guarded_tile.agent is not None:
             agent = trap.guarded_tile.agent
             dead_end = DeadEndTile()
-            dead_end.agent_move_on(agent)
+            dead_end.agent_move_on(agent, journal)
+
+    def execute_on_state(self, level, state, trap):
+        periodic_move_on_state(level, state, trap)
+
+        if crack_tile_on_state(level, state, trap):
+            return
+
+        if state.agent == trap[TRAP_GUARDED]:
+            DeadEndTile.agent_move_on_state(level, state)
+
+    def state_key(self):
+        return self.curr
 
     def __eq__(self, other):
         if isinstance(other, SpiderStrategy):
@@ -188,35 +253,56 @@ class LizardStrategy(TrapStrategy):
         self.agent = agent
         self.is_active = False
 
-    def execute(self, trap):
+    def execute(self, trap, journal=None):
         if self.is_active:
             if not isinstance(self.agent.current_position, DeadEndTile):
-                trap.current_position.trap_on_tile = None
-                trap.guarded_tile.is_guarded = False
-                trap.set_position(trap.guarded_tile)
-                self.next_tile.is_guarded = True
-                trap.guarded_tile = self.next_tile
+                trap.current_position.remove_trap(trap, journal)
+                set_attr(journal, trap.guarded_tile, "is_guarded", False)
+                trap.set_position(trap.guarded_tile, journal)
+                set_attr(journal, self.next_tile, "is_guarded", True)
+                set_attr(journal, trap, "guarded_tile", self.next_tile)
 
-                self.next_tile = self.agent.current_position
+                set_attr(journal, self, "next_tile", self.agent.current_position)
 
                 if isinstance(trap.current_position, CrackedTile):
                     if not trap.current_position.is_cracked:
-                        trap.current_position.is_cracked = True
+                        set_attr(journal, trap.current_position, "is_cracked", True)
                     elif trap.current_position.is_cracked_without_drop_tile():
-                        trap.current_position.is_destroyed = True
-                        trap.guarded_tile.is_guarded = False
-                        trap.guarded_tile = None
-                        trap.current_position = None
+                        set_attr(journal, trap.current_position, "is_destroyed", True)
+                        trap.current_position.remove_trap(trap, journal)
+                        set_attr(journal, trap.guarded_tile, "is_guarded", False)
+                        set_attr(journal, trap, "guarded_tile", None)
+                        set_attr(journal, trap, "current_position", None)
                         return
 
         else:
             if self.agent.current_position == self.next_tile:
-                self.is_active = True
+                set_attr(journal, self, "is_active", True)
 
         if trap.guarded_tile.agent is not None:
             agent = trap.guarded_tile.agent
             dead_end = DeadEndTile()
-            dead_end.agent_move_on(agent)
+            dead_end.agent_move_on(agent, journal)
+
+    def execute_on_state(self, level, state, trap):
+        next_tile, is_active = trap[TRAP_PHASE]
+        if is_active:
+            if state.agent is not None:
+                trap[TRAP_POS] = trap[TRAP_GUARDED]
+                trap[TRAP_GUARDED] = next_tile
+                trap[TRAP_PHASE] = (state.agent, is_active)
+
+                if crack_tile_on_state(level, state, trap):
+                    return
+
+        elif state.agent == next_tile:
+            trap[TRAP_PHASE] = (next_tile, True)
+
+        if state.agent is not None and state.agent == trap[TRAP_GUARDED]:
+            DeadEndTile.agent_move_on_state(level, state)
+
+    def state_key(self):
+        return self.next_tile.id, self.is_active
 
     def __eq__(self, other):
         if isinstance(other, LizardStrategy):
@@ -0,0 +1,311 @@
+from typing import Optional
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import socket
+import time
+
+from batch import STATUS_SOLVED, STATUS_UNSOLVED, STATUS_TIMEOUT, STATUS_ERROR
+from main import Solver, Algorithm
+from model.Game import Game, level_content_hash
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+STATUS_BUSY = "busy"
+
+HTTP_CODES = {STATUS_SOLVED: 200, STATUS_UNSOLVED: 200, STATUS_ERROR: 400, STATUS_BUSY: 503, STATUS_TIMEOUT: 504}
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+GAMES_PER_WORKER = 32
+
+
+def solve_request(games: dict, level_json: dict, algorithm: Algorithm, weight: float) -> dict:
+    """Solves one request inside a worker, games keeps the levels the worker parsed before by content hash."""
+    start = time.perf_counter()
+    content_hash = level_content_hash(level_json)
+    game = games.get(content_hash)
+    if game is None:
+        game = Game()
+        game.load_json(level_json)
+        if len(games) >= GAMES_PER_WORKER:
+            games.clear()
+        games[content_hash] = game
+
+    result = Solver(algorithm, weight).search(game)
+    status = STATUS_SOLVED if len(result.plan) > 0 else STATUS_UNSOLVED
+    return {"status": status, "plan": [action.name for action in result.plan], "expanded": result.expanded,
+            "generated": result.generated, "time": time.perf_counter() - start}
+
+
+def worker_main(conn):
+    games = {}
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        try:
+            reply = solve_request(games, *request)
+        except Exception as e:
+            reply = {"status": STATUS_ERROR, "error": repr(e)}
+        conn.send(reply)
+
+
+class Worker:
+    """Warm solver process fed through a pipe, spawned so it holds none of the service's sockets."""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    async def run(self, request) -> dict:
+        """Sends request and waits for the reply without blocking the event loop, EOFError once terminated."""
+        self.conn.send(request)
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        fd = self.conn.fileno()
+        loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+        finally:
+            loop.remove_reader(fd)
+        return self.conn.recv()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class Job:
+    def __init__(self, key: str, request: tuple):
+        self.key = key
+        self.request = request
+        self.future = asyncio.get_running_loop().create_future()
+        self.waiters = 0
+        self.queued = False
+        self.worker: Optional[Worker] = None
+
+
+class SolverService:
+    """Solves levels on a pool of warm worker processes behind a bounded queue.
+
+    Concurrent requests for the same level and solver settings share one job. A request waits at most its timeout,
+    a job nobody waits for any more is dropped from the queue or, when already running, its worker is terminated
+    and replaced. Only jobs still waiting for a worker count towards queue_size, dropped ones stay in the asyncio
+    queue until a worker skips them.
+    """
+
+    def __init__(self, workers: int = 1, queue_size: int = 64, timeout: float = 60.0):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.context = multiprocessing.get_context("spawn")
+        self.queue: Optional[asyncio.Queue] = None
+        self.queued = 0
+        self.jobs = {}
+        self.tasks = []
+        self.started_jobs = 0
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self.run_worker(Worker(self.context))) for _ in range(self.workers)]
+
+    async def close(self):
+        for job in list(self.jobs.values()):
+            self.cancel(job)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def run_worker(self, worker: Worker):
+        try:
+            while True:
+                job = await self.queue.get()
+                self.dequeue(job)
+                if job.future.done():
+                    continue
+
+                self.started_jobs += 1
+                job.worker = worker
+                try:
+                    reply = await worker.run(job.request)
+                except (EOFError, OSError):
+                    worker.stop()
+                    worker = Worker(self.context)
+                    reply = {"status": STATUS_ERROR, "error": "worker exited"}
+                finally:
+                    job.worker = None
+                    if self.jobs.get(job.key) is job:
+                        del self.jobs[job.key]
+                if not job.future.done():
+                    job.future.set_result(reply)
+        finally:
+            worker.stop()
+
+    def dequeue(self, job: Job):
+        if job.queued:
+            job.queued = False
+            self.queued -= 1
+
+    def cancel(self, job: Job):
+        self.dequeue(job)
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+        if not job.future.done():
+            job.future.cancel()
+        if job.worker is not None:
+            job.worker.process.terminate()
+
+    async def solve(self, level_json: dict, algorithm: Algorithm = Algorithm.ASTAR, weight: float = 2.0,
+                    timeout: Optional[float] = None) -> dict:
+        key = level_content_hash(level_json) + ":" + Solver(algorithm, weight).cache_settings()
+        job = self.jobs.get(key)
+        if job is None:
+            if self.queued >= self.queue_size:
+                return {"status": STATUS_BUSY}
+            job = Job(key, (level_json, algorithm, weight))
+            self.jobs[key] = job
+            job.queued = True
+            self.queued += 1
+            self.queue.put_nowait(job)
+
+        job.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(job.future), self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            return {"status": STATUS_TIMEOUT}
+        finally:
+            job.waiters -= 1
+            if job.waiters == 0 and not job.future.done():
+                self.cancel(job)
+
+    async def dispatch(self, method: str, target: str, body: bytes):
+        if method == "GET" and target == "/health":
+            return 200, {"status": "ok", "workers": self.workers, "queued": self.queued, "jobs": len(self.jobs)}
+        if method != "POST" or target != "/solve":
+            return 404, {"status": STATUS_ERROR, "error": "unknown endpoint " + method + " " + target}
+
+        try:
+            request = json.loads(body)
+            level_json = request["level"]
+            algorithm = Algorithm(request.get("algorithm", Algorithm.ASTAR.value))
+            weight = float(request.get("weight", 2.0))
+            timeout = request.get("timeout")
+            if timeout is not None:
+                timeout = float(timeout)
+                if not (math.isfinite(timeout) and timeout >= 0):
+                    raise ValueError("timeout must be a non-negative number of seconds, not " + str(timeout))
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {"status": STATUS_ERROR, "error": "malformed request: " + repr(e)}
+
+        reply = await self.solve(level_json, algorithm, weight, timeout)
+        return HTTP_CODES[reply["status"]], reply
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serves one HTTP request per connection, a client closing its connection cancels its request."""
+        try:
+            method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+        except (ValueError, asyncio.IncompleteReadError):
+            await self.respond(writer, 400, {"status": STATUS_ERROR, "error": "malformed request"})
+            return
+
+        request = asyncio.ensure_future(self.dispatch(method, target, body))
+        closed = asyncio.ensure_future(reader.read(1))
+        await asyncio.wait({request, closed}, return_when=asyncio.FIRST_COMPLETED)
+        closed.cancel()
+        if not request.done():
+            request.cancel()
+            writer.close()
+            return
+        await self.respond(writer, *request.result())
+
+    @staticmethod
+    async def respond(writer: asyncio.StreamWriter, code: int, reply: dict):
+        payload = json.dumps(reply).encode()
+        head = "HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+        writer.write((head % (code, HTTP_REASONS[code], len(payload))).encode("latin-1") + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def request_plan(level_json: dict, address=(DEFAULT_HOST, DEFAULT_PORT), algorithm: Algorithm = Algorithm.ASTAR,
+                 weight: float = 2.0, timeout: Optional[float] = None) -> dict:
+    """Client side of the service, address is a (host, port) pair or the path of a Unix socket."""
+    if isinstance(address, str):
+        connection = UnixHTTPConnection(address)
+    else:
+        connection = http.client.HTTPConnection(*address)
+    request = {"level": level_json, "algorithm": algorithm.value, "weight": weight}
+    if timeout is not None:
+        request["timeout"] = timeout
+    try:
+        connection.request("POST", "/solve", json.dumps(request), {"Content-Type": "application/json"})
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+async def serve(service: SolverService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                unix: Optional[str] = None):
+    await service.start()
+    if unix is not None:
+        server = await asyncio.start_unix_server(service.handle, unix)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Lara Croft Go plans over HTTP from warm solver processes")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on (default: " + DEFAULT_HOST + ")")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on (default: 8765)")
+    parser.add_argument("--unix", default=None, help="listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of solver processes")
+    parser.add_argument("--queue", type=int, default=64, help="requests waiting for a worker before new ones are "
+                                                              "refused (default: 64)")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="default time limit of a request in seconds (default: 60)")
+    args = parser.parse_args()
+
+    service = SolverService(args.workers, args.queue, args.timeout)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+from typing import List, Optional
+import json
+import sqlite3
+import threading
+import time
+
+from model.Agent import Action
+from model.Game import Game
+
+DEFAULT_CACHE = "./.solution_cache.sqlite"
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+def is_valid_plan(game: Game, plan: List[Action]) -> bool:
+    """Replays plan on the live game and undoes it again, True when every action succeeds and ends on a goal."""
+    made = 0
+    valid = True
+    for action in plan:
+        if not game.make(action):
+            valid = False
+            break
+        made += 1
+    valid = valid and game.agent.current_position.is_goal
+
+    for _ in range(made):
+        game.unmake()
+    return valid
+
+
+class SolutionCache:
+    """SQLite store of solved plans keyed by level content hash, start state and solver settings.
+
+    Entries are evicted least recently used first once the stored plans exceed max_bytes. One connection is shared
+    by all threads, a lock keeps them from using it at the same time.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, plan TEXT NOT NULL, "
+                                    "expanded INTEGER, generated INTEGER, pruned INTEGER, size INTEGER, "
+                                    "last_used REAL)")
+
+    @staticmethod
+    def key(game: Game, settings: str) -> Optional[str]:
+        if game.content_hash is None:
+            return None
+        start = game.compiled_level().state_of(game)
+        return game.content_hash + ":" + start.digest() + ":" + settings
+
+    def get(self, game: Game, settings: str):
+        """Returns (plan, expanded, generated, pruned) of a stored plan still solving game, otherwise None."""
+        key = self.key(game, settings)
+        if key is None:
+            return None
+
+        with self.lock:
+            row = self.connection.execute("SELECT plan, expanded, generated, pruned FROM solutions WHERE key = ?",
+                                          (key,)).fetchone()
+            if row is None:
+                return None
+
+            plan = [Action(action) for action in json.loads(row[0])]
+            with self.connection:
+                if not is_valid_plan(game, plan):
+                    self.connection.execute("DELETE FROM solutions WHERE key = ?", (key,))
+                    return None
+                self.connection.execute("UPDATE solutions SET last_used = ? WHERE key = ?", (time.time(), key))
+        return plan, row[1], row[2], row[3]
+
+    def put(self, game: Game, settings: str, plan: List[Action], expanded: int, generated: int, pruned: int):
+        key = self.key(game, settings)
+        if key is None or len(plan) == 0:
+            return
+
+        encoded = json.dumps([int(action) for action in plan])
+        size = len(key) + len(encoded)
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (key, encoded, expanded, generated, pruned, size, time.time()))
+            self.evict()
+
+    def evict(self):
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM solutions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in self.connection.execute("SELECT key, size FROM solutions ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM solutions WHERE key = ?", (key,))
+            total -= size
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -1,12 +1,34 @@
+import asyncio
+import csv
+import io
+import json
+import math
+import multiprocessing
+import os
+import pickle
 import unittest
 import random
-
-from main import Solver
+import shutil
+import signal
+import tempfile
+import threading
+
+import batch
+from batch import collect_level_paths, run_batch, solve_level, write_report, STATUS_SOLVED, STATUS_UNSOLVED, \
+    STATUS_ERROR, STATUS_TIMEOUT, STATUS_MEMORY
+from benchmark import benchmark_level, compare, missing_levels
+from generator import generate_level
+from main import Solver, Replanner, SearchNode, BucketQueue, DominanceIndex, state_owner, SearchStats, extract_plan, \
+    Algorithm
 from model.Agent import Agent, Action
-from model.Game import Game
+from model.Game import Game, TileUnpickler, level_content_hash, decode_moving_seq, COMPILED_SUFFIX
+from model.Level import Level, NO_TILE
 from model.Objects import Lever, ItemType, Item
-from model.Tiles import Tile, DeadEndTile, MovingTile
+from model.State import State
+from model.Tiles import Tile, DeadEndTile, MovingTile, CrackedTile, TILE_NORMAL, TILE_CRACKED, TILE_MOVING
 from model.Trap import Trap, SnakeStrategy, SawStrategy, TrapMovingDir, SpiderStrategy, LizardStrategy
+from service import SolverService, request_plan, STATUS_BUSY
+from solution_cache import SolutionCache
 
 
 class SolverTest(unittest.TestCase):
@@ -27,14 +49,27 @@ class SolverTest(unittest.TestCase):
     def test_heuristic(self):
         test_solver = Solver()
         goal, current, agent, tiles = self.generate_goal_curr_agent_tiles()
+        goal.set_as_goal()
 
         state = Game()
         state.tiles = tiles
         state.agent = agent
         state.goal = goal
 
-        result = 1 * (abs(current.x - goal.x) + abs(current.y - goal.y) + abs(current.z - goal.z))
-        self.assertEqual(result, test_solver.heuristic(state), "Test heuristic with random numbers")  # add assertion here
+        level = Level(state)
+        self.assertEqual(math.inf, test_solver.heuristic(level, level.initial_state), "Goal is not reachable")
+
+        detour = [Tile(3), Tile(4), CrackedTile(5)]
+        current.set_path(None, detour[0], None, None)
+        detour[0].set_path(current, None, detour[1], None)
+        detour[1].set_path(None, None, None, detour[2])
+        detour[2].set_drop_on_tile(goal)
+        tiles.update({3: detour[0], 4: detour[1], 5: detour[2]})
+
+        level = Level(state)
+        self.assertEqual(3, test_solver.heuristic(level, level.initial_state), "Goal is three moves away with drop")
+        self.assertEqual(0, level.goal_distance[level.index[goal.id]])
+        self.assertEqual(1, level.goal_distance[level.index[detour[1].id]])
 
     def test_get_neighbor_state_non_states(self):
         test_solver = Solver()
@@ -44,7 +79,8 @@ class SolverTest(unittest.TestCase):
         state.tiles = tiles
         state.agent = agent
 
-        self.assertEqual([], test_solver.get_neighbor_state(state, None), "Test get_neighbor_state should be empty")
+        level = Level(state)
+        self.assertEqual([], test_solver.get_neighbor_state(level, level.initial_state, None), "Test get_neighbor_state should be empty")
 
     def test_get_neighbor_state_get_states(self):
         test_solver = Solver()
@@ -56,11 +92,340 @@ class SolverTest(unittest.TestCase):
 
         lever.set_position(current)
         current.set_path(t1, None, t2, None)
+        t1.set_path(None, current, None, None)
+        t2.set_path(None, None, goal, current)
+        goal.set_as_goal()
         state = Game()
         state.tiles = tiles
         state.agent = agent
 
-        self.assertEqual(3, len(test_solver.get_neighbor_state(state, None)), "Test get_neighbor_state should get states")
+        level = Level(state)
+        self.assertEqual(3, len(test_solver.get_neighbor_state(level, level.initial_state, None)), "Test get_neighbor_state should get states")
+
+    def test_search_plan_reaches_goal(self):
+        for path in ["./levels/level1.json", "./levels/game/maze_of_snakes_3.json", "./levels/game/entrance_4.json"]:
+            game = Game()
+            game.play(path)
+            plan = Solver().search(game).plan
+
+            self.assertNotEqual(0, len(plan))
+            for action in plan:
+                self.assertEqual(True, game.make(action), "Plan action " + str(action) + " should be applicable")
+            self.assertEqual(True, game.agent.current_position.is_goal)
+
+    def test_search_algorithms(self):
+        for path in ["./levels/level1.json", "./levels/game/entrance_2.json"]:
+            optimal = None
+            for algorithm in Algorithm:
+                game = Game()
+                game.play(path)
+                result = Solver(algorithm, 2.0).search(game)
+
+                self.assertNotEqual(0, len(result.plan), str(algorithm) + " should solve " + path)
+                self.assertLessEqual(result.expanded, result.generated + 1)
+                for action in result.plan:
+                    self.assertEqual(True, game.make(action))
+                self.assertEqual(True, game.agent.current_position.is_goal)
+
+                if algorithm in (Algorithm.ASTAR, Algorithm.BFS, Algorithm.IDA_STAR, Algorithm.SMA_STAR):
+                    if optimal is None:
+                        optimal = len(result.plan)
+                    self.assertEqual(optimal, len(result.plan), str(algorithm) + " should find optimal plan")
+
+    def test_parallel_search(self):
+        for path, length in [("./levels/game/maze_of_snakes_4.json", 36), ("./levels/level2.json", 0)]:
+            game = Game()
+            game.play(path)
+            result = Solver(Algorithm.ASTAR, workers=3).search(game)
+
+            self.assertEqual(length, len(result.plan), path + " should be solved optimally")
+            for action in result.plan:
+                self.assertEqual(True, game.make(action))
+            self.assertEqual(length > 0, game.agent.current_position.is_goal)
+
+    def test_parallel_search_worker_failure(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_4.json")
+        heuristic = Solver.__dict__["heuristic"]
+
+        def raise_error(state):
+            raise ValueError("broken heuristic")
+
+        for fail in [raise_error, lambda state: os._exit(3)]:
+            def failing_heuristic(level, state):
+                if multiprocessing.parent_process() is not None and state_owner(state, 3) == 1:
+                    fail(state)
+                return heuristic.__func__(level, state)
+
+            Solver.heuristic = staticmethod(failing_heuristic)
+            try:
+                with self.assertRaises(RuntimeError):
+                    Solver(Algorithm.ASTAR, workers=3).search(game)
+            finally:
+                Solver.heuristic = heuristic
+
+    def test_state_owner(self):
+        game = Game()
+        game.play("./levels/game/entrance_2.json")
+        state = game.compiled_level().initial_state
+        self.assertEqual(state_owner(state, 4), state_owner(state._replace(item=ItemType.SPEAR), 4))
+        for resources in [dict(items=frozenset()), dict(items=frozenset({1, 2})), dict(air=(0,) * len(state.air))]:
+            self.assertEqual(state_owner(state, 7), state_owner(state._replace(**resources), 7))
+        self.assertEqual(True, 0 <= state_owner(state, 4) < 4)
+
+    def test_sma_star_memory_budget(self):
+        game = Game()
+        game.play("./levels/game/entrance_2.json")
+
+        for memory_nodes in [34, 40, None]:
+            solver = Solver(Algorithm.SMA_STAR, memory_nodes=memory_nodes)
+            result = solver.search(game)
+            self.assertEqual(33, len(result.plan), "optimal plan fits into " + str(memory_nodes) + " nodes")
+            if memory_nodes is not None:
+                self.assertLessEqual(solver.stats.max_open, memory_nodes)
+                self.assertLess(0, solver.stats.evicted)
+
+        for action in result.plan:
+            self.assertEqual(True, game.make(action))
+        self.assertEqual(True, game.agent.current_position.is_goal)
+
+        solver = Solver(Algorithm.SMA_STAR, memory_nodes=20)
+        self.assertEqual([], solver.search(game).plan, "plan of 33 actions does not fit into 20 nodes")
+
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_4.json")
+        solver = Solver(Algorithm.SMA_STAR, memory_nodes=30)
+        self.assertEqual([], solver.search(game).plan, "plan of 36 actions does not fit into 30 nodes")
+        self.assertLess(solver.stats.expanded, 10000, "gives up once the lowest f reaches the budget")
+
+    def test_search_stats(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_4.json")
+        reported = []
+        solver = Solver(stats_hook=reported.append)
+        result = solver.search(game)
+
+        stats = solver.stats
+        self.assertEqual([stats], reported)
+        self.assertEqual((result.expanded, result.generated, result.pruned),
+                         (stats.expanded, stats.generated, stats.pruned))
+        self.assertEqual({}, stats.phase_time, "phases are only timed when profiling")
+        self.assertLess(0, stats.duplicates)
+        self.assertLess(0, stats.max_open)
+
+        report = stats.as_dict()
+        self.assertEqual(stats.generated, sum(int(n) * count for n, count in report["branching"]["histogram"].items()))
+        self.assertEqual(stats.expanded - 1, sum(report["branching"]["histogram"].values()))
+
+        profiled = Solver(profile=True)
+        self.assertEqual(result, profiled.search(game))
+        self.assertEqual({"forbidden", "heuristic", "prune", "queue", "simulate", "successors"},
+                         set(profiled.stats.phase_time))
+        json.dumps(profiled.stats.as_dict())
+
+        unpickled = pickle.loads(pickle.dumps(profiled))
+        self.assertEqual(result, unpickled.search(game), "spawned workers get a pickled solver")
+        self.assertIn("successors", unpickled.stats.phase_time)
+
+    def test_extract_plan(self):
+        nodes = [SearchNode(None, None, None, 0), SearchNode(None, 0, Action.MOVE_UP, 1),
+                 SearchNode(None, 0, Action.MOVE_LEFT, 1), SearchNode(None, 1, Action.USE_LEVER, 2)]
+
+        self.assertEqual([Action.MOVE_UP, Action.USE_LEVER], extract_plan(nodes, 3))
+        self.assertEqual([], extract_plan(nodes, 0))
+
+    def test_dominance_index(self):
+        state = State(3, None, frozenset({7}), (), frozenset(), frozenset(), 0, (2,))
+        carrying = state._replace(item=ItemType.SPEAR, items=frozenset())
+        index = DominanceIndex()
+
+        self.assertFalse(index.dominated(state._replace(item=ItemType.SPEAR), 4))
+        self.assertTrue(index.dominated(state, 4), "carrying an item beats carrying none")
+        self.assertTrue(index.dominated(state._replace(items=frozenset()), 5), "more items left on tiles")
+        self.assertFalse(index.dominated(carrying, 3), "reached with fewer actions")
+        self.assertFalse(index.dominated(state._replace(agent=4), 9), "other position")
+        self.assertFalse(index.dominated(carrying._replace(air=(1,)), 9), "throws along another connection")
+        self.assertTrue(index.dominated(carrying._replace(air=(0,)), 9))
+        self.assertTrue(index.dominated(state._replace(items=frozenset(), air=(1,)), 9), "nothing left to throw")
+
+    def test_dominance_pruning(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_6d.json")
+        solver = Solver(Algorithm.BFS)
+        result = solver.search(game)
+
+        self.assertEqual(17, len(result.plan))
+        self.assertGreater(solver.stats.dominated, 0)
+
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_4.json")
+        level = game.compiled_level()
+        self.assertIsNone(solver.dominance_index(level, level.initial_state), "no items, nothing to dominate")
+
+    def test_corridor_macros(self):
+        game = Game()
+        game.play("./levels/game/entrance_1.json")
+        level = game.compiled_level()
+        state = level.initial_state
+
+        self.assertTrue(level.allows_macros(state))
+        macro = level.macros[state.agent][Action.MOVE_UP]
+        self.assertEqual((Action.MOVE_UP, Action.MOVE_UP), macro)
+        end = Solver().walk(level, state, macro, frozenset())
+        for action in macro:
+            state = Agent.apply_action_to_state(level, state, action)
+        self.assertEqual(state, end)
+        self.assertEqual(14, max(len(walk) for moves in level.macros if moves is not None for walk in moves.values()))
+
+        with_macros = Solver().search(game)
+        without_macros = Solver(macros=False).search(game)
+        self.assertEqual(without_macros.plan, with_macros.plan)
+        self.assertLess(with_macros.expanded, without_macros.expanded)
+
+    def test_macros_keep_plans_optimal(self):
+        row = [1, 2, 3, 4]
+        tiles_json = [{"id": t_id, "type": "Tile", "left": row[i - 1] if i > 0 else None,
+                       "right": row[i + 1] if i + 1 < len(row) else None, "up": None, "down": None,
+                       "air_connect": [], "is_goal": False} for i, t_id in enumerate(row)]
+        tiles_json[3].update({"type": "CrackedTile", "drop": 5})
+        tiles_json.append({"id": 5, "type": "Tile", "left": None, "right": None, "up": None, "down": None,
+                           "air_connect": [], "is_goal": True})
+        game = Game()
+        game.load_json({"tiles": tiles_json, "agent": {"pos": 2}, "traps": [], "items": [], "levers": []})
+        plan = Solver().search(game).plan
+        self.assertEqual([Action.MOVE_RIGHT, Action.MOVE_RIGHT, Action.MOVE_LEFT, Action.MOVE_RIGHT], plan)
+
+        for seed in [19, 29, 42]:
+            game = Game()
+            game.load_json(generate_level(8, 8, levels=2, cracked=6, snakes=2, lizards=1, density=0.7, seed=seed))
+            self.assertEqual(len(Solver(macros=False).search(game).plan), len(Solver().search(game).plan))
+
+    def test_macros_need_static_traps(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_4.json")
+        level = game.compiled_level()
+        self.assertFalse(level.allows_macros(level.initial_state), "saws keep moving")
+        self.assertTrue(level.allows_macros(level.initial_state._replace(traps=())))
+
+    def test_anytime_search(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_6a.json")
+
+        result = Solver(Algorithm.ANYTIME, 3.0).search(game)
+        self.assertEqual(33, len(result.plan))
+        self.assertEqual(33, result.bound, "open list exhausted, plan proven optimal")
+
+        limited = Solver(Algorithm.ANYTIME, 3.0, max_expansions=40).search(game)
+        self.assertLessEqual(limited.expanded, 40)
+        self.assertLessEqual(limited.bound, 33)
+        self.assertTrue(len(limited.plan) == 0 or len(limited.plan) >= 33)
+
+        cancel = threading.Event()
+        cancel.set()
+        cancelled = Solver(Algorithm.ANYTIME, 3.0).search(game, cancel)
+        self.assertEqual(([], 0), (cancelled.plan, cancelled.expanded))
+        level = game.compiled_level()
+        self.assertEqual(Solver.heuristic(level, level.initial_state), cancelled.bound)
+
+    def test_anytime_time_budget(self):
+        game = Game()
+        game.load_json(generate_level(40, 40, levels=2, cracked=10, snakes=30, moving=10, levers=5, density=0.7,
+                                      seed=3))
+        result = Solver(Algorithm.ANYTIME, 4.0, time_budget=0.0).search(game)
+        self.assertEqual(0, result.expanded)
+
+        result = Solver(Algorithm.ANYTIME, 4.0, max_expansions=100).search(game)
+        self.assertGreater(len(result.plan), 0, "a first plan comes quickly")
+        self.assertLessEqual(result.bound, len(result.plan))
+
+    def test_ida_star_limits(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_4.json")
+        result = Solver(Algorithm.IDA_STAR).search(game)
+        self.assertEqual(36, len(result.plan), "transposition table keeps the plan optimal")
+
+        limited = Solver(Algorithm.IDA_STAR, max_expansions=40).search(game)
+        self.assertEqual([], limited.plan)
+        self.assertLessEqual(limited.expanded, 40)
+        self.assertLessEqual(limited.bound, 36)
+        self.assertEqual(1, Solver(Algorithm.IDA_STAR, time_budget=0.0).search(game).expanded, "only the start")
+
+    def test_replan_along_plan(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_6a.json")
+        replanner = Replanner()
+        plan = replanner.plan(game).plan
+        self.assertEqual(33, len(plan))
+
+        for action in plan[:10]:
+            game.make(action)
+        advanced = replanner.plan(game)
+        self.assertEqual((plan[10:], 0), (advanced.plan, advanced.expanded))
+
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_1a.json")
+        traps = len(game.traps)
+        plan = replanner.plan(game).plan
+        for i, action in enumerate(plan):
+            game.make(action)
+            advanced = replanner.plan(game)
+            self.assertEqual((plan[i + 1:], 0), (advanced.plan, advanced.expanded), "after " + str(i + 1) + " moves")
+        self.assertLess(len(game.traps), traps, "the plan kills traps")
+
+        self.assertRaises(ValueError, Replanner, Solver(Algorithm.WEIGHTED_ASTAR, 2.0))
+
+    def test_replan_profiled(self):
+        game = Game()
+        game.play("./levels/level0.json")
+        replanner = Replanner(Solver(profile=True))
+        plan = replanner.plan(game).plan
+        self.assertEqual(4, len(plan))
+        self.assertIn("heuristic", replanner.stats.phase_time)
+
+        game.make(plan[0])
+        self.assertEqual(plan[1:], replanner.plan(game).plan)
+
+    def test_replan_after_deviation(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_4.json")
+        replanner = Replanner()
+        plan = replanner.plan(game).plan
+
+        for action in plan[:5]:
+            game.make(action)
+        deviation = next(action for action in Action if action != plan[5] and game.make(action))
+        replanned = replanner.plan(game)
+        fresh = Solver().search(game)
+        self.assertEqual(len(fresh.plan), len(replanned.plan), "still optimal after " + deviation.name)
+        self.assertLess(replanned.expanded, fresh.expanded)
+
+    def test_replan_edited_level(self):
+        with open("./levels/game/maze_of_snakes_6a.json") as f:
+            level_json = json.load(f)
+        game = Game()
+        game.load_json(level_json)
+        replanner = Replanner()
+        plan = replanner.plan(game).plan
+
+        level_json["traps"].pop()
+        edited = Game()
+        edited.load_json(level_json)
+        replanned = replanner.plan(edited)
+        self.assertEqual(len(Solver().search(edited).plan), len(replanned.plan))
+        self.assertLessEqual(len(replanned.plan), len(plan), "the old plan bounds the new one")
+
+    def test_bucket_queue(self):
+        queue = BucketQueue()
+        for f, h, item in [(5, 2, "a"), (3, 1, "b"), (5, 1, "c"), (3, 1, "d"), (4.5, 0, "e"), (math.inf, math.inf, "f")]:
+            queue.put(f, h, item)
+        self.assertEqual(6, len(queue))
+        self.assertEqual((3, 1), queue.peek())
+
+        order = [queue.get()[2] for _ in range(6)]
+        self.assertEqual(["d", "b", "e", "c", "a", "f"], order, "lowest (f, h) first, last in first out on ties")
+        self.assertTrue(queue.empty())
+        self.assertIsNone(queue.peek())
+        self.assertEqual({}, queue.buckets)
 
     def test_is_forbidden_action(self):
         test_solver = Solver()
@@ -71,45 +436,104 @@ class SolverTest(unittest.TestCase):
         state.agent = agent
         state.goal = goal
 
-        test_solver.forbidden_pos.append((current.x, current.y + 1, current.z))
-        test_solver.forbidden_pos.append((current.x + 1, current.y, current.z))
-
-        self.assertEqual(True, test_solver.is_forbidden_action(Action.MOVE_UP, state, None))
-        self.assertEqual(True, test_solver.is_forbidden_action(Action.MOVE_RIGHT, state, None))
-        self.assertEqual(False, test_solver.is_forbidden_action(Action.MOVE_DOWN, state, None))
-        self.assertEqual(False, test_solver.is_forbidden_action(Action.MOVE_LEFT, state, None))
-        self.assertEqual(False, test_solver.is_forbidden_action(Action.USE_LEVER, state, None))
-        self.assertEqual(False, test_solver.is_forbidden_action(Action.USE_ITEM, state, None))
+        up = Tile(3)
+        right = Tile(4)
+        up.set_coords(current.x, current.y + 1, current.z)
+        right.set_coords(current.x + 1, current.y, current.z)
+        tiles.update({3: up, 4: right})
+
+        level = Level(state)
+        compact = level.initial_state
+        forbidden = frozenset({level.index[up.id], level.index[right.id]})
+
+        self.assertEqual(True, test_solver.is_forbidden_action(level, Action.MOVE_UP, compact, None, forbidden))
+        self.assertEqual(True, test_solver.is_forbidden_action(level, Action.MOVE_RIGHT, compact, None, forbidden))
+        self.assertEqual(False, test_solver.is_forbidden_action(level, Action.MOVE_DOWN, compact, None, forbidden))
+        self.assertEqual(False, test_solver.is_forbidden_action(level, Action.MOVE_LEFT, compact, None, forbidden))
+        self.assertEqual(False, test_solver.is_forbidden_action(level, Action.USE_LEVER, compact, None, forbidden))
+        self.assertEqual(False, test_solver.is_forbidden_action(level, Action.USE_ITEM, compact, None, forbidden))
+        self.assertEqual(False, test_solver.is_forbidden_action(level, Action.MOVE_UP, compact, None))
+
+    def test_forbidden_tiles(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_4.json")
+        level = game.level
+        state = level.initial_state
+
+        forbidden = Solver().forbidden_tiles(level, state)
+        saws = {trap[1] for trap in state.traps if level.trap_is_saw[trap[0]]}
+        guarded = {trap[2] for trap in state.traps if not level.trap_is_saw[trap[0]] and level.trap_attack_able[trap[0]]}
+        self.assertEqual(saws | guarded, forbidden)
+        self.assertIs(forbidden, level.forbidden_tiles(state._replace(agent=None)), "agent does not change the set")
+
+        for path in ["./levels/game/maze_of_snakes_6a.json", "./levels/level3.json"]:
+            game = Game()
+            game.play(path)
+            level = game.level
+            state = level.initial_state
+            cracked = [i for i in range(len(level.ids)) if level.types[i] == TILE_CRACKED]
+            crossed = set()
+            for action in Solver().search(game).plan:
+                state = Agent.apply_action_to_state(level, state, action)
+                crossed.add(state.agent)
+                forbidden = level.forbidden_tiles(state)
+                for tile in cracked:
+                    self.assertEqual(tile in crossed and level.drop[tile] == NO_TILE, tile in forbidden,
+                                     path + ": cracked tile " + str(level.ids[tile]))
+            self.assertEqual(True, any(tile in crossed for tile in cracked), path + " crosses a cracked tile")
+
+    def test_concurrent_search(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_4.json")
+        other = Game()
+        other.play("./levels/game/entrance_2.json")
+        solver = Solver()
+        expected = {id(game): solver.search(game), id(other): solver.search(other)}
+
+        results = []
+        threads = [threading.Thread(target=lambda g=g: results.append((id(g), solver.search(g))))
+                   for g in [game, other, game, other]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for game_id, result in results:
+            self.assertEqual(expected[game_id], result)
+
+
+def grid_game():
+    """Plain tiles in rows 5-7, 0-4 and 8-10, the agent starts on tile 0 and the goal is tile 10."""
+    game = Game()
+    tiles = {}
+    for i in range(0, 11):
+        tiles.update({i: Tile(i)})
+
+    tiles[0].set_path(None, tiles[1], None, None)
+    tiles[1].set_path(tiles[0], tiles[2], tiles[5], tiles[8])
+    tiles[2].set_path(tiles[1], tiles[3], tiles[6], tiles[9])
+    tiles[3].set_path(tiles[2], tiles[4], tiles[7], tiles[10])
+    tiles[4].set_path(tiles[3], None, None, None)
+    tiles[5].set_path(None, tiles[6], None, tiles[1])
+    tiles[6].set_path(tiles[5], tiles[7], None, tiles[2])
+    tiles[7].set_path(tiles[6], None, None, tiles[3])
+    tiles[8].set_path(None, tiles[9], tiles[1], None)
+    tiles[9].set_path(tiles[8], tiles[10], tiles[2], None)
+    tiles[10].set_path(tiles[9], None, tiles[3], None)
+    tiles[10].set_as_goal()
+
+    agent = Agent()
+    agent.set_position(tiles[0])
+
+    game.tiles = tiles
+    game.agent = agent
+    game.goal = tiles[10]
+    return game
 
 
 class TrapTest(unittest.TestCase):
 
     def generate_game_state(self):
-        game = Game()
-        tiles = {}
-        for i in range(0, 11):
-            tiles.update({i: Tile(i)})
-
-        tiles[0].set_path(None, tiles[1], None, None)
-        tiles[1].set_path(tiles[0], tiles[2], tiles[5], tiles[8])
-        tiles[2].set_path(tiles[1], tiles[3], tiles[6], tiles[9])
-        tiles[3].set_path(tiles[2], tiles[4], tiles[7], tiles[10])
-        tiles[4].set_path(tiles[3], None, None, None)
-        tiles[5].set_path(None, tiles[6], None, tiles[1])
-        tiles[6].set_path(tiles[5], tiles[7], None, tiles[2])
-        tiles[7].set_path(tiles[6], None, None, tiles[3])
-        tiles[8].set_path(None, tiles[9], tiles[1], None)
-        tiles[9].set_path(tiles[8], tiles[10], tiles[2], None)
-        tiles[10].set_path(tiles[9], None, tiles[3], None)
-        tiles[10].set_as_goal()
-
-        agent = Agent()
-        agent.set_position(tiles[0])
-
-        game.tiles = tiles
-        game.agent = agent
-        game.goal = tiles[10]
-        self.game_state = game
+        self.game_state = grid_game()
 
     def test_kill_trap(self):
         self.generate_game_state()
@@ -374,6 +798,319 @@ class TrapTest(unittest.TestCase):
         self.assertEqual(tiles[2], saw_trap.current_position)
 
 
+class LevelTest(unittest.TestCase):
+
+    def assert_same_successors(self, game, level, state, depth):
+        if depth == 0:
+            return
+        for action in Action:
+            clone = game.clone()
+            applied = clone.agent.apply_action(action, clone.traps)
+            next_state = Agent.apply_action_to_state(level, state, action)
+
+            self.assertEqual(bool(applied), next_state is not None, "Action " + str(action) + " applicability")
+            if applied:
+                self.assertEqual(level.state_of(clone), next_state)
+                self.assert_same_successors(clone, level, next_state, depth - 1)
+
+    def test_compact_state_matches_object_model(self):
+        for path in ["./levels/level1.json", "./levels/level2.json", "./levels/level6.json"]:
+            game = Game()
+            game.play(path)
+            level = Level(game)
+            self.assert_same_successors(game, level, level.initial_state, 4)
+
+    def test_compact_spider_and_lizard(self):
+        game = grid_game()
+
+        spider_trap = Trap(True)
+        spider_trap.set_position(game.tiles[6])
+        spider_trap.set_trap(game.tiles[2], SpiderStrategy([TrapMovingDir.DOWN, TrapMovingDir.UP, TrapMovingDir.UP, TrapMovingDir.DOWN]))
+        game.traps.append(spider_trap)
+
+        lizard_trap = Trap(True)
+        lizard_trap.set_position(game.tiles[4])
+        lizard_trap.set_trap(game.tiles[3], LizardStrategy(game.tiles[1], game.agent))
+        game.traps.append(lizard_trap)
+
+        level = Level(game)
+        self.assert_same_successors(game, level, level.initial_state, 4)
+
+    def test_compact_state_after_kills(self):
+        for path in ["./levels/game/maze_of_snakes_1a.json", "./levels/game/maze_of_snakes_6b.json"]:
+            game = Game()
+            game.play(path)
+            level = game.level
+            plan = Solver(Algorithm.ASTAR, 1).search(game).plan
+            state = level.initial_state
+            for action in plan:
+                self.assertTrue(game.agent.apply_action(action, game.traps))
+                state = Agent.apply_action_to_state(level, state, action)
+                self.assertEqual(level.state_of(game), state)
+            self.assertLess(len(state.traps), len(level.initial_state.traps))
+
+    def test_compact_saw_passing_over_snake(self):
+        rows = [[1, 2, 3, 4], [5, 6, 7]]
+        tiles_json = []
+        for row in rows:
+            for i, t_id in enumerate(row):
+                tiles_json.append({"id": t_id, "type": "Tile", "left": row[i - 1] if i > 0 else None,
+                                   "right": row[i + 1] if i + 1 < len(row) else None, "up": None, "down": None,
+                                   "air_connect": [], "is_goal": t_id == 7})
+        traps_json = [{"type": "Snake", "can_attack": True, "pos": 2, "guards": 3},
+                      {"type": "Saw", "can_attack": False, "pos": 1, "guards": 2, "moving_seq": ["r", "l"]}]
+        game = Game()
+        game.load_json({"tiles": tiles_json, "agent": {"pos": 5}, "traps": traps_json, "items": [], "levers": []})
+        level = game.level
+        self.assert_same_successors(game, level, level.initial_state, 4)
+
+        game.agent.apply_action(Action.MOVE_RIGHT, game.traps)
+        self.assertEqual([2, 2], [trap.current_position.id for trap in game.traps])
+        snake = game.traps[0]
+        game.agent.apply_action(Action.MOVE_LEFT, game.traps)
+        self.assertEqual(None, snake.current_position)
+
+    def test_trap_transition_table(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_3.json")
+        level = game.level
+
+        needs_moving = False
+        for index, pos, guarded, phase in level.initial_state.traps:
+            transitions = level.trap_transitions[index]
+            moving_seq = level.trap_strategies[index].guarded_tile_moving_seq
+            self.assertEqual(len(moving_seq), len(transitions))
+            self.assertEqual(phase, level.trap_config(index, pos, guarded, 0))
+
+            configs = {config: key for key, config in level.trap_configs[index].items()}
+            for config, (need, moved) in enumerate(transitions):
+                pos, guarded, curr = configs[config]
+                next_config, next_pos, next_guarded = moved
+                self.assertEqual((guarded, level.trap_neighbor(guarded, moving_seq[curr]), (curr + 1) % len(moving_seq)),
+                                 configs[next_config])
+                self.assertEqual((guarded, next_guarded), configs[next_config][:2])
+                for tile in (pos, next_guarded):
+                    if level.types[tile] == TILE_MOVING:
+                        self.assertEqual(1, need >> level.moving_bit[tile] & 1)
+                needs_moving = needs_moving or need != 0
+        self.assertEqual(True, needs_moving, "a saw of maze_of_snakes_3 moves over a moving tile")
+
+    def test_compiled_level_arrays(self):
+        game = Game()
+        game.play("./levels/level1.json")
+        level = game.level
+        index = level.index
+
+        self.assertEqual(8, len(level.ids))
+        self.assertEqual(TILE_MOVING, level.types[index[3]])
+        self.assertEqual(TILE_CRACKED, level.types[index[6]])
+        self.assertEqual(TILE_NORMAL, level.types[index[7]])
+        self.assertEqual(index[3], level.down[index[2]])
+        self.assertEqual(NO_TILE, level.left[index[2]])
+        self.assertEqual(index[8], level.drop[index[6]])
+        self.assertEqual(1 << level.moving_bit[index[3]], level.lever_masks[index[2]])
+        self.assertEqual(None, level.lever_masks[index[1]])
+        self.assertEqual(True, bool(level.goals[index[8]]))
+        self.assertEqual(index[8], level.goal)
+
+    def test_is_hopeless(self):
+        game = Game()
+        game.play("./levels/level3.json")
+        level = game.level
+        index = level.index
+        start = level.initial_state
+
+        self.assertEqual(False, level.is_hopeless(start))
+        self.assertEqual(True, level.is_hopeless(start._replace(agent=None)))
+        self.assertEqual(False, level.is_hopeless(start._replace(agent=index[2], cracked=frozenset({index[3]}))))
+        self.assertEqual(True, level.is_hopeless(start._replace(agent=index[2], cracked=frozenset({index[3]}),
+                                                                destroyed=frozenset({index[3]}))))
+
+    def test_get_neighbor_state_prunes_hopeless(self):
+        game = Game()
+        game.play("./levels/level3.json")
+        level = game.level
+        state = level.initial_state._replace(agent=level.index[2], cracked=frozenset({level.index[4]}))
+
+        stats = SearchStats()
+        neighbors = Solver().get_neighbor_state(level, state, None, stats)
+        self.assertEqual([Action.MOVE_UP, Action.MOVE_LEFT], [action for action, n in neighbors])
+        self.assertEqual(0, stats.pruned)
+
+        state = state._replace(cracked=frozenset({level.index[3], level.index[4]}), destroyed=frozenset({level.index[3]}))
+        stats = SearchStats()
+        self.assertEqual([], Solver().get_neighbor_state(level, state, None, stats))
+        self.assertEqual(2, stats.pruned)
+
+    def test_state_of_clone(self):
+        game = Game()
+        game.play("./levels/game/maze_of_snakes_4.json")
+        level = Level(game)
+
+        state = level.initial_state
+        self.assertEqual(state, level.state_of(game.clone()))
+        self.assertEqual(4, len(state.traps))
+        self.assertEqual(0, state.active)
+
+
+class GameTest(unittest.TestCase):
+
+    def test_compiled_level(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "entrance_2.json")
+            shutil.copy("./levels/game/entrance_2.json", path)
+
+            game = Game()
+            game.play(path)
+            self.assertEqual(False, os.path.exists(path + COMPILED_SUFFIX))
+
+            game.play(path, compiled=True)
+            self.assertEqual(True, os.path.exists(path + COMPILED_SUFFIX))
+
+            compiled = Game()
+            self.assertEqual(True, compiled.load_compiled(path))
+            self.assertEqual(game.state_key(), compiled.state_key())
+            self.assertEqual(game.content_hash, compiled.content_hash)
+            self.assertEqual([tile.x for tile in game.tiles.values()], [tile.x for tile in compiled.tiles.values()])
+            self.assertEqual(Solver().search(game), Solver().search(compiled))
+            self.assertIs(compiled.tiles[1], compiled.tiles[1].right.left)
+
+            with open(path, "a") as f:
+                f.write("\n")
+            self.assertEqual(False, Game().load_compiled(path), "compiled level is stale once the json changes")
+
+    def test_planted_compiled_level(self):
+        class Planted:
+            def __init__(self, victim):
+                self.victim = victim
+
+            def __reduce__(self):
+                return os.remove, (self.victim,)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "entrance_2.json")
+            victim = os.path.join(directory, "victim")
+            shutil.copy("./levels/game/entrance_2.json", path)
+            Game().play(path, compiled=True)
+            with open(path + COMPILED_SUFFIX, "rb") as f:
+                header = f.readline()
+            open(victim, "w").close()
+
+            for prefix in [b"", header]:
+                with open(path + COMPILED_SUFFIX, "wb") as f:
+                    f.write(prefix + pickle.dumps(Planted(victim)))
+                self.assertEqual(False, Game().load_compiled(path))
+                self.assertEqual(True, os.path.exists(victim), "planted pickle must not run")
+
+            with open(victim, "wb") as f:
+                f.write(b"12345678")
+
+            def text(value):
+                return b"\x8c" + bytes([len(value.encode())]) + value.encode()
+            payload = b"\x80\x04" + text("model.Game") + text("pickle.io.FileIO") + b"\x93" + text(victim) + \
+                text("w") + b"\x86R."
+            self.assertRaises(pickle.UnpicklingError, TileUnpickler(io.BytesIO(payload), {}).load)
+            with open(path + COMPILED_SUFFIX, "wb") as f:
+                f.write(header + payload)
+            self.assertEqual(False, Game().load_compiled(path))
+            self.assertEqual(8, os.path.getsize(victim), "dotted names must not reach other modules")
+
+    def test_decode_moving_seq(self):
+        self.assertEqual([TrapMovingDir.UP, TrapMovingDir.LEFT, TrapMovingDir.RIGHT, TrapMovingDir.DOWN],
+                         decode_moving_seq(["u", "l", "x", "r", "d"]))
+
+    def test_state_key_of_clone(self):
+        game = Game()
+        game.play("./levels/level1.json")
+        clone = game.clone()
+
+        self.assertEqual(game.state_key(), clone.state_key())
+        self.assertEqual(hash(game.state_key()), hash(clone.state_key()))
+
+        clone.agent.apply_action(Action.MOVE_DOWN, clone.traps)
+        self.assertNotEqual(game.state_key(), clone.state_key())
+
+    def test_state_key_saw_phase(self):
+        game = Game()
+        game.play("./levels/level6.json")
+        clone = game.clone()
+        clone.traps[0].trap_strategy.curr += 1
+
+        self.assertNotEqual(game.state_key(), clone.state_key())
+
+    def test_state_key_air_connection(self):
+        game = Game()
+        game.play("./levels/level2.json")
+        clone = game.clone()
+        clone.tiles[1].pop_air_connection()
+
+        self.assertNotEqual(game.state_key(), clone.state_key())
+
+    @staticmethod
+    def full_snapshot(game):
+        tiles_info = []
+        for tile in game.tiles.values():
+            trap_pos = None
+            if tile.trap_on_tile is not None and tile.trap_on_tile.current_position is not None:
+                trap_pos = tile.trap_on_tile.current_position.id
+            tiles_info.append((tile.id, tile.agent is not None, tile.is_guarded, trap_pos))
+        return game.state_key(), len(game.traps), tuple(tiles_info)
+
+    def test_moving_tiles_share_bitmask(self):
+        game = Game()
+        game.play("./levels/game/entrance_2.json")
+        level = game.level
+
+        moving = [tile for tile in game.tiles.values() if isinstance(tile, MovingTile)]
+        bits = moving[0].bits
+        self.assertEqual(True, all(tile.bits is bits for tile in moving))
+        self.assertEqual(level.initial_state.active, bits.mask)
+
+        lever = game.tiles[4].lever
+        self.assertIs(bits, lever.bits)
+        self.assertEqual(level.lever_masks[level.index[4]], lever.mask)
+
+        active = [tile.is_active for tile in moving]
+        lever.use_lever(game.journal)
+        self.assertEqual(level.initial_state.active ^ lever.mask, bits.mask)
+        self.assertEqual([not active[i] if tile in lever.activates else active[i] for i, tile in enumerate(moving)],
+                         [tile.is_active for tile in moving])
+        game.journal.undo()
+        self.assertEqual(level.initial_state.active, bits.mask)
+
+        clone = game.clone()
+        clone.tiles[4].lever.use_lever()
+        self.assertEqual(level.initial_state.active, bits.mask)
+        self.assertEqual(level.state_of(clone).active, clone.tiles[5].bits.mask)
+
+    def test_make_unmake(self):
+        random.seed(3)
+        for path in ["./levels/level1.json", "./levels/level2.json", "./levels/game/maze_of_snakes_3.json", "./levels/game/maze_of_snakes_6b.json"]:
+            game = Game()
+            game.play(path)
+
+            snapshots = [self.full_snapshot(game)]
+            for i in range(30):
+                if game.make(random.choice(list(Action))):
+                    snapshots.append(self.full_snapshot(game))
+                else:
+                    self.assertEqual(snapshots[-1], self.full_snapshot(game))
+
+            while len(game.made_marks) > 0:
+                snapshots.pop()
+                game.unmake()
+                self.assertEqual(snapshots[-1], self.full_snapshot(game))
+
+    def test_make_matches_apply_action(self):
+        game = Game()
+        game.play("./levels/level1.json")
+        clone = game.clone()
+
+        for action in [Action.MOVE_DOWN, Action.USE_LEVER, Action.MOVE_DOWN, Action.MOVE_DOWN]:
+            self.assertEqual(clone.agent.apply_action(action, clone.traps), game.make(action))
+            self.assertEqual(clone.state_key(), game.state_key())
+
+
 class AgentTest(unittest.TestCase):
 
     def test_move_left(self):
@@ -441,5 +1178,323 @@ class AgentTest(unittest.TestCase):
         self.assertEqual(agent, down.agent)
 
 
+class BatchTest(unittest.TestCase):
+
+    def test_collect_level_paths(self):
+        paths = collect_level_paths(["./levels"])
+        self.assertEqual(True, os.path.join("./levels", "level0.json") in paths)
+        self.assertEqual(True, os.path.join("./levels", "game", "entrance_1.json") in paths)
+
+        paths = collect_level_paths(["./levels/level[01].json", "./levels/level0.json"])
+        self.assertEqual(["./levels/level0.json", "./levels/level1.json"], paths)
+
+    def test_run_batch(self):
+        results = list(run_batch(["./levels/level0.json", "./levels/level2.json", "./levels/missing.json"], workers=2,
+                                 timeout=30))
+        statuses = {result.level: result.status for result in results}
+        self.assertEqual({"./levels/level0.json": STATUS_SOLVED, "./levels/level2.json": STATUS_UNSOLVED,
+                          "./levels/missing.json": STATUS_ERROR}, statuses)
+
+        solved = [result for result in results if result.status == STATUS_SOLVED][0]
+        self.assertEqual(["MOVE_UP", "MOVE_UP", "MOVE_RIGHT", "MOVE_RIGHT"], solved.plan)
+
+    def test_worker_exit_status(self):
+        solve = batch.solve_level
+        for exit_worker, status in [(lambda: os._exit(3), STATUS_ERROR),
+                                    (lambda: os.kill(os.getpid(), signal.SIGABRT), STATUS_MEMORY)]:
+            batch.solve_level = lambda *args: exit_worker()
+            try:
+                result = list(run_batch(["./levels/level0.json"], timeout=30, memory_limit_mb=1024))[0]
+            finally:
+                batch.solve_level = solve
+            self.assertEqual(status, result.status)
+            self.assertEqual(True, result.error.startswith("worker exited with code"))
+
+    def test_write_report(self):
+        result = solve_level("./levels/level0.json")
+        out = io.StringIO()
+        write_report([result], out, "csv")
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual("MOVE_UP MOVE_UP MOVE_RIGHT MOVE_RIGHT", rows[0]["plan"])
+
+        out = io.StringIO()
+        write_report([result], out)
+        self.assertEqual(STATUS_SOLVED, json.loads(out.getvalue())["status"])
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_benchmark_compare(self):
+        result = benchmark_level("./levels/level0.json", repeat=1)
+        self.assertEqual((4, 7, 4), (result.expanded, result.generated, result.plan_length))
+
+        baseline = {result.level: result._asdict()}
+        self.assertEqual([], compare([result], baseline))
+        self.assertEqual([], compare([result], {}))
+        self.assertEqual([], missing_levels([result], baseline))
+        self.assertEqual([result.level], missing_levels([result], {}))
+
+        slower = result._replace(expanded=6, time=1.0)
+        self.assertEqual(["expanded", "time"], [regression.metric for regression in compare([slower], baseline)])
+
+    def test_benchmark_repeat(self):
+        with self.assertRaises(ValueError):
+            benchmark_level("./levels/level0.json", repeat=0)
+
+
+class SolutionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_content_hash(self):
+        with open("./levels/level1.json") as f:
+            level_json = json.load(f)
+        path = os.path.join(self.directory.name, "level1.json")
+        with open(path, "w") as f:
+            json.dump(level_json, f, indent=4)
+
+        game, reformatted = Game(), Game()
+        game.play("./levels/level1.json")
+        reformatted.play(path)
+        self.assertEqual(game.content_hash, reformatted.content_hash)
+        self.assertEqual(game.content_hash, level_content_hash(level_json))
+
+        level_json["agent"]["pos"] = level_json["tiles"][-1]["id"]
+        self.assertNotEqual(game.content_hash, level_content_hash(level_json))
+
+    def test_cache_hit(self):
+        cache = SolutionCache(self.path)
+        game = Game()
+        game.play("./levels/level1.json")
+
+        self.assertEqual(None, cache.get(game, "astar"))
+        result = Solver(cache=cache).search(game)
+        cached = cache.get(game, "astar")
+        self.assertEqual((result.plan, result.expanded, result.generated, result.pruned), cached)
+        self.assertEqual(None, cache.get(game, "bfs"))
+        self.assertEqual(result, Solver(cache=cache).search(game))
+
+        state_key = game.state_key()
+        cache.get(game, "astar")
+        self.assertEqual(state_key, game.state_key(), "validating a plan should leave the game untouched")
+        cache.close()
+
+    def test_cache_shared_by_threads(self):
+        cache = SolutionCache(self.path)
+        solver = Solver(cache=cache)
+        games = []
+        for path in ["./levels/level1.json", "./levels/game/entrance_2.json"] * 2:
+            game = Game()
+            game.play(path)
+            games.append(game)
+
+        results = []
+        threads = [threading.Thread(target=lambda g=g: results.append(len(solver.search(g).plan))) for g in games]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4, len(results), "no search raised")
+        self.assertNotIn(0, results)
+        self.assertTrue(solver.search(games[1]).plan and solver.stats.cached)
+        cache.close()
+
+    def test_cache_key_start_state_and_settings(self):
+        cache = SolutionCache(self.path)
+        game = Game()
+        game.play("./levels/level0.json")
+        plan = Solver(cache=cache).search(game).plan
+
+        game.make(plan[0])
+        self.assertEqual(None, cache.get(game, "astar"), "advanced game has its own entry")
+        self.assertEqual(plan[1:], Solver(cache=cache).search(game).plan)
+        game.unmake()
+        self.assertEqual(plan, cache.get(game, "astar")[0], "entry of the level start survives")
+
+        self.assertNotEqual(Solver().cache_settings(), Solver(macros=False).cache_settings())
+        self.assertNotEqual(Solver(Algorithm.ANYTIME).cache_settings(),
+                            Solver(Algorithm.ANYTIME, max_expansions=10).cache_settings())
+        self.assertNotEqual(Solver(Algorithm.SMA_STAR).cache_settings(),
+                            Solver(Algorithm.SMA_STAR, memory_nodes=40).cache_settings())
+        cache.close()
+
+    def test_invalid_plan_is_dropped(self):
+        cache = SolutionCache(self.path)
+        game = Game()
+        game.play("./levels/level1.json")
+
+        cache.put(game, "astar", [Action.MOVE_UP], 1, 1, 0)
+        self.assertEqual(None, cache.get(game, "astar"))
+        self.assertEqual(0, cache.connection.execute("SELECT COUNT(*) FROM solutions").fetchone()[0])
+        cache.close()
+
+    def test_eviction(self):
+        cache = SolutionCache(self.path, max_bytes=200)
+        games = []
+        for path in ["./levels/level0.json", "./levels/level3.json", "./levels/level4.json"]:
+            game = Game()
+            game.play(path)
+            Solver(cache=cache).search(game)
+            games.append(game)
+
+        self.assertEqual(None, cache.get(games[0], "astar"))
+        self.assertNotEqual(None, cache.get(games[2], "astar"))
+        cache.close()
+
+
+class GeneratorTest(unittest.TestCase):
+
+    def test_generate_level(self):
+        options = dict(levels=2, cracked=3, moving=3, levers=2, snakes=2, saws=1, spiders=1, lizards=1, spears=1, seed=7)
+        level_json = generate_level(8, 6, **options)
+        self.assertEqual(level_json, generate_level(8, 6, **options))
+        self.assertNotEqual(level_json, generate_level(8, 6, **dict(options, seed=8)))
+
+        self.assertEqual(1, sum(tile["is_goal"] for tile in level_json["tiles"]))
+        self.assertEqual(3, sum(tile["type"] == "MovingTile" for tile in level_json["tiles"]))
+        self.assertEqual(2, len(level_json["levers"]))
+        self.assertEqual(["Snake", "Snake", "Saw", "Spider", "Lizard"], [trap["type"] for trap in level_json["traps"]])
+        self.assertEqual(1, len(level_json["items"]))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "generated.json")
+            with open(path, "w") as f:
+                json.dump(level_json, f)
+            game = Game()
+            game.play(path)
+
+        self.assertEqual(len(level_json["tiles"]), len(game.level.ids))
+        self.assertEqual(1, game.level.coords[game.level.index[game.goal.id]][2] + 2, "goal is on the bottom level")
+
+    def test_generated_spears_have_targets(self):
+        options = dict(levels=2, cracked=3, snakes=2, saws=1, spiders=1, lizards=1, spears=1)
+        for seed in range(8, 12):
+            level_json = generate_level(8, 6, seed=seed, **options)
+            attackable = {trap["pos"] for trap in level_json["traps"] if trap["can_attack"]}
+            trapped = {trap[key] for trap in level_json["traps"] for key in ("pos", "guards")}
+            throwers = [tile for tile in level_json["tiles"] if len(tile["air_connect"]) > 0]
+            self.assertEqual(1, len(throwers))
+            self.assertNotIn(throwers[0]["id"], trapped)
+            self.assertLessEqual(set(throwers[0]["air_connect"]), attackable)
+
+            game = Game()
+            game.load_json(level_json)
+            self.assertEqual(1, len(game.level.air_targets))
+
+    def test_generated_level_is_solvable_without_traps(self):
+        level_json = generate_level(12, 12, levels=3, cracked=10, seed=3)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "generated.json")
+            with open(path, "w") as f:
+                json.dump(level_json, f)
+            game = Game()
+            game.play(path)
+
+        result = Solver().search(game)
+        self.assertNotEqual(0, len(result.plan))
+        for action in result.plan:
+            self.assertEqual(True, game.make(action))
+        self.assertEqual(True, game.agent.current_position.is_goal)
+
+
+class ServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        with open("./levels/level1.json") as f:
+            self.level = json.load(f)
+        self.slow_level = generate_level(60, 60, levels=3, cracked=20, snakes=20, seed=1)
+
+    @staticmethod
+    def run_service(scenario, workers=1, queue_size=4):
+        async def run():
+            service = SolverService(workers, queue_size, timeout=30.0)
+            await service.start()
+            server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+            try:
+                return await scenario(service, server.sockets[0].getsockname()[1])
+            finally:
+                server.close()
+                await server.wait_closed()
+                await service.close()
+        return asyncio.run(run())
+
+    def test_solve_over_http(self):
+        async def scenario(service, port):
+            return await asyncio.get_running_loop().run_in_executor(None, request_plan, self.level,
+                                                                    ("127.0.0.1", port))
+
+        reply = self.run_service(scenario)
+        self.assertEqual(STATUS_SOLVED, reply["status"])
+        self.assertEqual(9, len(reply["plan"]))
+
+    def test_identical_requests_share_job(self):
+        async def scenario(service, port):
+            replies = await asyncio.gather(*[service.solve(self.level) for _ in range(4)])
+            return replies, service.started_jobs
+
+        replies, started_jobs = self.run_service(scenario)
+        self.assertEqual([replies[0]] * 4, replies)
+        self.assertEqual(1, started_jobs)
+
+    def test_timeout_replaces_worker(self):
+        async def scenario(service, port):
+            timed_out = await service.solve(self.slow_level, timeout=0.05)
+            return timed_out, dict(service.jobs), await service.solve(self.level)
+
+        timed_out, jobs, reply = self.run_service(scenario)
+        self.assertEqual(STATUS_TIMEOUT, timed_out["status"])
+        self.assertEqual({}, jobs)
+        self.assertEqual(STATUS_SOLVED, reply["status"])
+
+    def test_full_queue_refuses_requests(self):
+        async def scenario(service, port):
+            running = asyncio.create_task(service.solve(self.slow_level))
+            await asyncio.sleep(0.1)
+            queued = asyncio.create_task(service.solve(generate_level(60, 60, levels=3, seed=2)))
+            await asyncio.sleep(0)
+            refused = await service.solve(self.level)
+            running.cancel()
+            queued.cancel()
+            await asyncio.gather(running, queued, return_exceptions=True)
+            return refused, dict(service.jobs)
+
+        refused, jobs = self.run_service(scenario, queue_size=1)
+        self.assertEqual(STATUS_BUSY, refused["status"])
+        self.assertEqual({}, jobs, "cancelled requests drop their jobs")
+
+    def test_dropped_jobs_free_the_queue(self):
+        async def scenario(service, port):
+            running = asyncio.create_task(service.solve(self.slow_level))
+            await asyncio.sleep(0.1)
+            dropped = await service.solve(generate_level(60, 60, levels=3, seed=2), timeout=0.01)
+            queued = asyncio.create_task(service.solve(self.level))
+            await asyncio.sleep(0)
+            health = await service.dispatch("GET", "/health", b"")
+            running.cancel()
+            await asyncio.gather(running, return_exceptions=True)
+            return dropped, health[1]["queued"], await queued
+
+        dropped, queued, reply = self.run_service(scenario, queue_size=1)
+        self.assertEqual(STATUS_TIMEOUT, dropped["status"])
+        self.assertEqual(1, queued)
+        self.assertEqual(STATUS_SOLVED, reply["status"])
+
+    def test_malformed_timeout(self):
+        async def scenario(service, port):
+            replies = []
+            for timeout in ["soon", [1], -1, float("nan"), float("inf")]:
+                body = json.dumps({"level": self.level, "timeout": timeout}).encode()
+                replies.append(await service.dispatch("POST", "/solve", body))
+            return replies
+
+        for code, reply in self.run_service(scenario):
+            self.assertEqual((400, STATUS_ERROR), (code, reply["status"]))
+
+
 if __name__ == '__main__':
     unittest.main()